@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Optional, List
+
+from flask import jsonify, request
+
+from shared_cache import shared_cache
+
+# =================================================================
+# Admission control for Gemini-bound routes.
+# * Rate limiting: token buckets per client address, per user (X-User-Id,
+#   when sent) and per bin, shared by all workers on the host (stored in the
+#   shared cache). An empty bucket is an immediate 429 with Retry-After,
+#   before any work is done. The address bucket is what bounds a client: the
+#   user id is chosen by the client, so it only ever adds a bucket. Behind a
+#   reverse proxy, set RATE_LIMIT_CLIENT_HEADER to the header the proxy
+#   writes with the real client address (e.g. X-Real-IP).
+# * Concurrency limiting: GEMINI_MAX_CONCURRENCY is the limit for the whole
+#   host. Each worker process gets an equal share of it (divided by
+#   WEB_CONCURRENCY, the number of workers, at least 1 slot each). Up to
+#   GEMINI_MAX_QUEUE more calls per worker wait in priority order for at
+#   most GEMINI_QUEUE_TIMEOUT seconds. A full queue or an expired wait is a
+#   fast 503 with Retry-After.
+# Cheap routes (/api/fridge, templates, ...) never pass through here, and
+# the bounded queue caps how many worker threads can be parked on Gemini, so
+# keep the per-worker slots + GEMINI_MAX_QUEUE below the worker's thread
+# count to always leave room for them.
+# =================================================================
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+HOST_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+MAX_CONCURRENCY = max(1, HOST_MAX_CONCURRENCY // WORKER_COUNT)
+MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "8"))
+QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10"))
+
+CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "")
+CLIENT_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_CLIENT_PER_MINUTE", "10"))
+CLIENT_BURST = float(os.getenv("RATE_LIMIT_CLIENT_BURST", "5"))
+BIN_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_BIN_PER_MINUTE", "20"))
+BIN_BURST = float(os.getenv("RATE_LIMIT_BIN_BURST", "10"))
+
+# Lower runs first. Follow-up calls of an already admitted request go ahead
+# of new requests.
+PRIORITY = {"estimate": 0, "analyze": 1, "recipes": 2}
+
+
+class AdmissionError(Exception):
+    """A request was turned away; carries the HTTP status and Retry-After seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimited(AdmissionError):
+    status_code = 429
+
+
+class Overloaded(AdmissionError):
+    status_code = 503
+
+
+class ConcurrencyLimiter:
+    """A semaphore with a bounded, priority-ordered wait queue."""
+
+    def __init__(self, max_concurrency: int, max_queue: int, timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: List[tuple] = []
+        self._seq = itertools.count()
+        self._avg_hold = 5.0  # seconds, moving average of slot hold time
+
+    def retry_after(self) -> float:
+        """Rough seconds until a new request could get a slot."""
+        return self._avg_hold * (len(self._waiting) + 1) / self.max_concurrency
+
+    def acquire(self, priority: int = 1) -> float:
+        """
+        Waits for a slot. Raises Overloaded if the queue is full or the wait
+        times out.
+
+        Returns:
+            The acquisition time, to pass to release().
+        """
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                return time.monotonic()
+
+            if len(self._waiting) >= self.max_queue:
+                raise Overloaded("Gemini queue is full", self.retry_after())
+
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.monotonic() + self.timeout
+
+            while not (self._active < self.max_concurrency and self._waiting[0] == ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise Overloaded("Timed out waiting for a Gemini slot", self.retry_after())
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            # The next ticket may be able to run too
+            self._cond.notify_all()
+            return time.monotonic()
+
+    def release(self, acquired_at: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - acquired_at)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "host_max_concurrency": HOST_MAX_CONCURRENCY,
+                "workers": WORKER_COUNT,
+                "max_queue": self.max_queue,
+                "avg_hold_seconds": round(self._avg_hold, 2),
+            }
+
+
+gemini_limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+
+
+def client_address() -> str:
+    """The caller's address for rate limiting: the trusted proxy's header if configured, else the peer."""
+    if CLIENT_HEADER and request.headers.get(CLIENT_HEADER):
+        return request.headers[CLIENT_HEADER].split(",")[0].strip()
+    return request.remote_addr or "unknown"
+
+
+def check_rate_limits(address: str, bin_ids: List[str], user_id: Optional[str] = None) -> None:
+    """
+    Takes one token from the bucket of the client's address, of the user
+    (if given) and of each bin, or raises RateLimited.
+    """
+    keys = [f"client:{address}"]
+    if user_id:
+        keys.append(f"user:{user_id}")
+
+    for key in keys:
+        wait = shared_cache.take_token(key, CLIENT_RATE_PER_MINUTE / 60, CLIENT_BURST)
+        if wait > 0:
+            raise RateLimited("Too many requests from this client", wait)
+
+    for bin_id in bin_ids:
+        wait = shared_cache.take_token(f"bin:{bin_id}", BIN_RATE_PER_MINUTE / 60, BIN_BURST)
+        if wait > 0:
+            raise RateLimited(f"Too many requests for bin {bin_id}", wait)
+
+
+def handle_admission_error(e: AdmissionError):
+    """Flask error handler: fast 429/503 with Retry-After."""
+    print(f"Admission refused ({e.status_code}): {e}")
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = e.status_code
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
@@ -1,20 +1,32 @@
-from flask import Flask, request, render_template, jsonify
-from google import genai
+from flask import Flask, Blueprint, Response, request, render_template, jsonify, stream_with_context
+import hashlib
+import heapq
+import json
 import os
-from dotenv import load_dotenv
-import requests
-import data
+import time
 from datetime import datetime
 
+from dotenv import load_dotenv
 
-today_date = datetime.now().strftime("%d/%m/%Y")
-import json
+# Before the local imports: several of them read their settings from the
+# environment at import time.
+load_dotenv()
 
+import admission
+import bulk_io
+import clients
+import data
+import gemini
+from calorie_log import calorie_log
+from expiry_index import expiry_index
+from shared_cache import shared_cache
+from singleflight import inflight
+import nutrition
+import profiling
 
-load_dotenv()
 
-app = Flask(__name__)
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# All routes live on this blueprint; create_app() registers it on a fresh app.
+bp = Blueprint("foodgie", __name__)
 
 # id for the json bin. Stores all data.
 BIN_ID = "68fd49ac43b1c97be980cfb7"
@@ -22,30 +34,227 @@ BIN_ID = "68fd49ac43b1c97be980cfb7"
 # id for testing only, contains garbage.
 TEST_BIN_ID = "68fd3d3c43b1c97be980b98b"
 
+# Most bins one multi-bin request may read
+MAX_BINS_PER_REQUEST = 10
+
+# Seconds results stay in the process-shared cache (see shared_cache.py)
+ANALYZE_CACHE_TTL = int(os.getenv("ANALYZE_CACHE_TTL", "86400"))
+RECIPE_CACHE_TTL = int(os.getenv("RECIPE_CACHE_TTL", "300"))
+
+
+# Static instruction blocks. These are identical for every request, so the
+# Gemini layer sends them once as a cached prefix (or system instruction) and
+# each request only carries its own data.
+ANALYZE_INSTRUCTIONS = """Analyze the food image and return the data as a Python dictionary. Follow these guidelines carefully:
+
+CRITICAL FORMATTING RULES:
+- Return ONLY valid JSON format within a Python dictionary structure
+- Use the exact field names and structure shown in the example
+- All numerical values must be integers (no decimals, no quotes)
+- Return ONLY the fields name, type, quantity and unit
+
+DATA REQUIREMENTS:
+
+1. NAME: Use common, singular food names (e.g., "coca cola" not "Coca-Cola 330ml can", "apple" not "apples")
+
+2. TYPE: Choose from: "fruit", "vegetable", "protein", "grains", "dairy", "beverage", "snacks", "condiments"
+
+3. QUANTITY AND UNITS:
+- quantity: Always an integer number
+- unit: Choose from these exact options:
+    * "items" - for individual pieces (fruits, vegetables, packaged items)
+    * "grams" - for meat, cheese, bulk foods
+    * "containers" - for bottles, cans, cartons, packages
+    * "eggs" - specifically for eggs
+
+RULES:
+- For SOLID items: count individual pieces → unit: "items" (e.g., 6 apples)
+- For LIQUIDS/BEVERAGES: count containers → unit: "containers" (e.g., 2 bottles of soda)
+- For MEAT/PROTEINS: use grams → unit: "grams" (e.g., 500g chicken)
+- For EGGS: use count → unit: "eggs" (e.g., 12 eggs)
+- NEVER use volume measurements (no ml, liters, cups, etc.)
+
+EXAMPLE OUTPUT FORMAT:
+{"inventory": [
+    {"name": "orange", "type": "fruit", "quantity": 6, "unit": "items"},
+    {"name": "coca cola", "type": "beverage", "quantity": 4, "unit": "containers"},
+    {"name": "chicken breast", "type": "protein", "quantity": 500, "unit": "grams"},
+    {"name": "egg", "type": "protein", "quantity": 12, "unit": "eggs"}
+]}"""
+
+# Gemini only identifies the food in /analyze; this asks for nutrition and
+# shelf life of foods missing from the local reference table.
+ESTIMATE_INSTRUCTIONS = """For each food listed by the user, estimate TOTAL nutrition for the quantity shown and the
+realistic refrigerator shelf life in days from purchase today.
+
+Return ONLY a JSON object with one entry per food, in the same order, all values integers:
+{"inventory": [{"calories": 372, "carbs": 93, "fats": 0, "protein": 0, "shelf_life_days": 7}]}"""
+
+RECIPE_INSTRUCTIONS = """Generate the requested number of diverse and nutritionally balanced recipe recommendations for the inventory given by the user, following these STRICT RULES:
 
-@app.route("/")
+🔴 PRIORITY RULES (MOST IMPORTANT):
+1. **ALWAYS prioritize ingredients expiring soonest** (items listed first MUST be used first)
+2. Items expiring in 0-3 days = CRITICAL - MUST use in recipes
+3. Items expiring in 4-7 days = HIGH priority
+4. Items expiring in 8+ days = MEDIUM priority
+
+🏠 INVENTORY-ONLY REQUIREMENT:
+**AT LEAST ONE recipe MUST use ONLY ingredients from the inventory (no additional ingredients except basic seasonings like salt/pepper).**
+- Mark this recipe with "inventory_only": true
+- For this recipe, get creative with what's available in the fridge
+- You can assume basic pantry items: salt, pepper, cooking oil/butter
+- NO other additional ingredients allowed for the inventory-only recipe
+
+🥗 DIVERSITY REQUIREMENTS:
+1. Each recipe MUST use ingredients from AT LEAST 2-3 different food types (e.g., protein + vegetable + grain)
+2. Across all recipes, try to use items from ALL available food types listed by the user
+3. Don't create recipes using only one food type (e.g., not just fruits or just vegetables)
+4. Balance macronutrients: aim for recipes with protein, carbs, and healthy fats
+
+📊 CRITICAL NUTRITIONAL CALCULATION RULES:
+**READ THIS CAREFULLY - THIS IS THE MOST IMPORTANT PART:**
+
+1. Each inventory item shows TWO nutrition values:
+   - TOTAL nutrition = for ALL units in inventory (e.g., 637 cal for 7 bananas)
+   - PER-UNIT nutrition = for ONE unit (e.g., 91 cal per 1 banana)
+
+2. **YOU MUST USE THE PER-UNIT VALUES IN YOUR CALCULATIONS!**
+   - If using 2 bananas: 2 × 91 cal = 182 cal (NOT 2 × 637 = 1274 cal!)
+   - If using 200 grams of chicken (per-unit is per 100g): 2 × per-unit value
+
+3. **CALCULATION FORMULA:**
+   ```
+   Recipe Nutrition = Σ(quantity_used × per_unit_nutrition) + additional_ingredients_nutrition
+   ```
+
+4. **EXAMPLE CALCULATION:**
+   - Recipe uses: 3 bananas + 1 cup yogurt (150 cal)
+   - Banana per-unit: 91 cal, 0g protein, 23g carbs, 0g fats
+   - Calculation: (3 × 91) + 150 = 273 + 150 = 423 total calories
+   - Final: 423 cal, 3g protein, 69g carbs, 0g fats
+
+5. **TARGET: Aim for recipes around the user's TARGET CALORIES PER MEAL per serving**
+
+6. Each recipe should aim for balanced macros:
+   - Protein: 15-30g per serving
+   - Carbs: 30-60g per serving
+   - Fats: 10-25g per serving
+
+🍳 RECIPE REQUIREMENTS:
+- Use realistic quantities from inventory (don't use more than available)
+- **CRITICAL: ALWAYS include the unit when specifying quantities** (e.g., "2 items of apples" or "200 grams of chicken")
+- When listing inventory items used, show the nutrition calculation clearly
+- Instructions should be 4-8 detailed steps
+- Cooking time should be realistic (15-60 minutes)
+- STRICTLY follow any DIETARY RESTRICTIONS given by the user
+- Try to match any CUISINE PREFERENCE given by the user
+
+Format your response as a JSON array. Each recipe must include accurate nutritional calculations using PER-UNIT values:
+
+[
+  {
+    "name": "Recipe Name",
+    "inventory_only": false,
+    "inventory_items_used": [
+      "2 items of banana (182 cal from 2 × 91 cal per item, 0g protein, 46g carbs, 0g fats)",
+      "200 grams of chicken (220 cal from 2 × 110 cal per 100g, 44g protein, 0g carbs, 4g fats)"
+    ],
+    "additional_ingredients": ["1 cup yogurt (150 cal, 10g protein, 20g carbs, 2g fats)", "salt", "pepper"],
+    "instructions": ["Step 1...", "Step 2...", "Step 3...", "Step 4..."],
+    "cooking_time": "30 minutes",
+    "servings": 2,
+    "nutrition_per_serving": {
+      "calories": 276,
+      "protein": 27,
+      "carbs": 33,
+      "fats": 3
+    },
+    "total_nutrition": {
+      "calories": 552,
+      "protein": 54,
+      "carbs": 66,
+      "fats": 6
+    },
+    "food_types_used": ["protein", "fruit", "dairy"],
+    "urgency": "high",
+    "urgency_reason": "Uses bananas expiring in 6 days"
+  }
+]
+
+URGENCY LEVELS:
+- "high" = uses items expiring within 3 days
+- "medium" = uses items expiring within 7 days  
+- "low" = uses items expiring after 7 days
+
+⚠️ CRITICAL REMINDERS:
+1. **USE PER-UNIT NUTRITION VALUES, NOT TOTAL VALUES!**
+2. Show your calculation in the inventory_items_used list (e.g., "2 × 91 cal per item")
+3. Always include units (items, grams, containers, eggs)
+4. Double-check that your total nutrition makes sense for the quantity used
+5. AT LEAST ONE recipe must have "inventory_only": true
+6. AT LEAST ONE recipe must have additional items beyond seasonings
+"""
+
+
+def _current_user_id(request_data=None):
+    """Identifies whose calorie log to use: X-User-Id header, then user_id in the body."""
+    return (
+        request.headers.get("X-User-Id")
+        or (request_data or {}).get("user_id")
+        or request.args.get("user_id")
+        or "default"
+    )
+
+
+def _calorie_goals(request_data):
+    """
+    (daily_calories, daily_meals) from a recipe request, or None if either is
+    missing. Raises ValueError if they are not positive whole numbers.
+    """
+    daily_calories = request_data.get("daily_calories")
+    daily_meals = request_data.get("daily_meals")
+    if not daily_calories or not daily_meals:
+        return None
+    try:
+        goals = (int(daily_calories), int(daily_meals))
+    except (TypeError, ValueError):
+        raise ValueError("daily_calories and daily_meals must be whole numbers") from None
+    if min(goals) <= 0:
+        raise ValueError("daily_calories and daily_meals must be positive")
+    return goals
+
+
+def _valid_bin_ids(bin_ids):
+    return (
+        isinstance(bin_ids, list)
+        and 0 < len(bin_ids) <= MAX_BINS_PER_REQUEST
+        and all(isinstance(bin_id, str) and bin_id for bin_id in bin_ids)
+    )
+
+
+@bp.route("/")
 def index():
     return render_template("index.html")
 
 
-@app.route("/settings")
+@bp.route("/settings")
 def settings():
     return render_template("settings.html")
 
 
-@app.route("/fridge")
+@bp.route("/fridge")
 def fridge():
     return render_template("fridge.html")
 
 
 
-@app.route("/recipes")
+@bp.route("/recipes")
 def recipes_page():
     return render_template("recipes.html")
 
 
 
-@app.route("/api/fridge/<bin_id>")
+@bp.route("/api/fridge/<bin_id>")
 def get_fridge_data(bin_id):
     fridge_data = data.read_data_from_bin(bin_id)
     if fridge_data:
@@ -54,26 +263,125 @@ def get_fridge_data(bin_id):
         return jsonify({"error": "Failed to retrieve fridge data"}), 500
 
 
-@app.route("/api/fridge/<bin_id>", methods=["PUT"])
+@bp.route("/api/fridges")
+def get_household_data():
+    """
+    Reads several bins at once (?bins=fridge_id,freezer_id,pantry_id) and
+    returns one merged inventory where every item carries its "source_bin".
+    Bins that could not be read are listed in "failed" instead of failing
+    the whole request.
+    """
+    bin_ids = [bin_id for bin_id in request.args.get("bins", "").split(",") if bin_id]
+    if not _valid_bin_ids(bin_ids):
+        return jsonify({"error": f"bins must list 1 to {MAX_BINS_PER_REQUEST} bin ids"}), 400
+
+    records, failed = data.read_data_from_bins(bin_ids)
+
+    inventory = [
+        dict(item, source_bin=bin_id)
+        for bin_id, record in records.items()
+        for item in record.get("inventory", [])
+    ]
+    result = {
+        "inventory": inventory,
+        "bins": {bin_id: {"items": len(record.get("inventory", []))} for bin_id, record in records.items()},
+        "failed": failed,
+    }
+
+    if not records:
+        return jsonify(dict(result, error="Failed to retrieve fridge data")), 502
+    return jsonify(result)
+
+
+@bp.route("/api/fridge/<bin_id>", methods=["PUT"])
 def update_fridge_data(bin_id):
     updated_data = request.json
 
-    url = f"{data.BASE_URL}/{bin_id}"
-    headers = {"Content-Type": "application/json", "X-Master-Key": data.MASTER_KEY}
+    if data.replace_data_in_bin(bin_id, updated_data):
+        return jsonify({"success": True})
+    else:
+        return jsonify({"error": "Failed to update fridge data"}), 500
 
-    response = requests.put(url, headers=headers, data=json.dumps(updated_data))
 
-    try:
-        response.raise_for_status()
-        return jsonify({"success": True})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@bp.route("/api/fridge/<bin_id>/export")
+def export_fridge_data(bin_id):
+    """Streams the bin's inventory as NDJSON, one item per line."""
+    fridge_data = data.read_data_from_bin(bin_id)
+    if fridge_data is None:
+        return jsonify({"error": "Failed to retrieve fridge data"}), 500
+
+    return Response(
+        stream_with_context(bulk_io.export_ndjson(fridge_data.get("inventory", []))),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={bin_id}.ndjson"},
+    )
+
+
+@bp.route("/api/fridge/<bin_id>/import", methods=["POST"])
+def import_fridge_data(bin_id):
+    """
+    Imports an NDJSON body (one item per line) into the bin.
+    ?mode=append (default) adds to the inventory, ?mode=replace overwrites it.
+    Invalid rows are skipped and reported by line number. A replace that
+    would leave the bin empty is refused unless ?allow_empty=1 is given;
+    imports over bulk_io.IMPORT_MAX_ROWS / IMPORT_MAX_BYTES get a 413.
+    """
+    mode = request.args.get("mode", "append")
+    if mode not in ("append", "replace"):
+        return jsonify({"error": "mode must be 'append' or 'replace'"}), 400
+
+    allow_empty = request.args.get("allow_empty") in ("1", "true")
+
+    report = bulk_io.import_ndjson(bin_id, request.stream, mode, allow_empty)
+    if report["success"]:
+        return jsonify(report), 200
+    if report.get("too_large"):
+        return jsonify(report), 413
+    return jsonify(report), 400 if report.get("refused") else 500
+
+
+@bp.route("/api/fridge/<bin_id>/expiring")
+def get_expiring_items(bin_id):
+    """
+    Items expiring within ?days=N (default 3) and items already expired,
+    answered from the expiry index without scanning the rest of the inventory.
+    """
+    days = request.args.get("days", 3, type=int)
+
+    if not data.refresh_expiry_index(bin_id):
+        return jsonify({"error": "Failed to retrieve fridge data"}), 500
+
+    return jsonify(
+        {
+            "expired": expiry_index.expired(bin_id),
+            "expiring": [
+                dict(item, days_left=days_left)
+                for days_left, item in expiry_index.expiring_within(bin_id, days)
+            ],
+        }
+    )
+
+
+@bp.route("/api/fridge/<bin_id>/urgency")
+def get_urgency(bin_id):
+    """The bin's precomputed urgency list (expired / critical / high), see expiry_index.py."""
+    if not data.refresh_expiry_index(bin_id):
+        return jsonify({"error": "Failed to retrieve fridge data"}), 500
+
+    urgency = expiry_index.urgency(bin_id)
+    if urgency is None:
+        return jsonify({"error": "Failed to retrieve fridge data"}), 500
+
+    return jsonify(urgency)
 
-@app.route("/api/consume/<bin_id>", methods=["POST"])
+
+@bp.route("/api/consume/<bin_id>", methods=["POST"])
 def consume_items(bin_id):
     """
     Consume items from inventory when a recipe is made.
     Expects JSON: {"consumed": {"apple": 2, "chicken": 200}}
+    Optional "meal": {"name", "calories", "protein", "carbs", "fats"} logs the
+    recipe totals; otherwise the nutrition of the consumed items is logged.
     """
     try:
         consumed_data = request.get_json()
@@ -86,10 +394,41 @@ def consume_items(bin_id):
         if not consumed_map:
             return jsonify({"error": "Empty consumption map"}), 400
         
+        meal = consumed_data.get("meal") or {}
+        if not isinstance(meal, dict):
+            return jsonify({"error": "Invalid meal: expected an object"}), 400
+        if meal:
+            # Reject bad meal totals before the bin is written
+            try:
+                nutrition.parse_nutrition(meal)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid meal: {e}"}), 400
+
         print(f"Processing consumption for bin {bin_id}: {consumed_map}")
         
         # Use the data.py consume function
-        data.consume_data_from_bin(bin_id, consumed_map)
+        result = data.consume_data_from_bin(bin_id, consumed_map)
+
+        if result is None:
+            return jsonify({"error": "Failed to update inventory"}), 500
+
+        # Feed the server-side calorie log, unless nothing matched and no meal
+        # was given. The consume is already committed, so a logging failure is
+        # reported rather than failing the request.
+        user_id = _current_user_id(consumed_data)
+        log_result = {}
+        try:
+            if meal or any(result["consumed"].values()):
+                calorie_log.append(
+                    user_id,
+                    meal.get("name") or ", ".join(result["consumed"]),
+                    meal if meal else result["nutrition"],
+                    source="consume",
+                )
+            log_result["today"] = calorie_log.daily_totals(user_id)
+        except Exception as e:
+            print(f"Error logging consumption for {user_id}: {e}")
+            log_result["error"] = f"Consumption was not logged: {e}"
         
         # Return the updated inventory
         updated_data = data.read_data_from_bin(bin_id)
@@ -97,7 +436,8 @@ def consume_items(bin_id):
         return jsonify({
             "success": True,
             "message": "Items consumed successfully",
-            "inventory": updated_data
+            "inventory": updated_data,
+            "calorie_log": log_result,
         })
         
     except Exception as e:
@@ -106,39 +446,51 @@ def consume_items(bin_id):
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/generate-recipes", methods=["POST"])
+@bp.route("/api/generate-recipes", methods=["POST"])
 def generate_recipes():
-    """Generate recipe recommendations based on inventory, prioritizing expiring items"""
+    """
+    Generate recipe recommendations based on inventory, prioritizing expiring items.
+    Optional "bin_ids" in the body draws on several bins (fridge, freezer, pantry).
+    """
     try:
-        # Read inventory from bin
-        inventory_data = data.read_data_from_bin(
-            TEST_BIN_ID
-        )  # Change to BIN_ID for actual use
+        request_data = request.get_json() or {}
+
+        # Read inventory from the requested bins
+        bin_ids = request_data.get("bin_ids") or [TEST_BIN_ID]  # Change to BIN_ID for actual use
+        if not _valid_bin_ids(bin_ids):
+            return jsonify({"error": f"bin_ids must be a list of at most {MAX_BINS_PER_REQUEST} ids"}), 400
+
+        try:
+            calorie_goals = _calorie_goals(request_data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Raises admission.RateLimited (429) before any work is done
+        admission.check_rate_limits(
+            admission.client_address(), bin_ids, request.headers.get("X-User-Id")
+        )
+
+        bin_versions = {bin_id: shared_cache.bin_version(bin_id) for bin_id in bin_ids}
+        records, failed_bins = data.read_data_from_bins(bin_ids)
 
-        if not inventory_data or "inventory" not in inventory_data:
+        if not any("inventory" in record for record in records.values()):
             return jsonify({"error": "No inventory found"}), 400
 
-        items = inventory_data["inventory"]
+        items = [item for record in records.values() for item in record.get("inventory", [])]
 
         if not items:
             return jsonify({"error": "Inventory is empty"}), 400
 
-        # Sort by expiry date (earliest first)
-        from datetime import datetime
-
-        def parse_date(item):
-            try:
-                return datetime.strptime(
-                    item.get("expected_expiry_date", "31/12/2099"), "%d/%m/%Y"
-                )
-            except:
-                return datetime.max
-
-        sorted_items = sorted(items, key=parse_date)
+        # Items by expiry date (earliest first), straight from the expiry
+        # indexes that the reads above refreshed, merged across bins
+        sorted_entries = list(heapq.merge(
+            *(expiry_index.ordered(bin_id) for bin_id in records),
+            key=lambda entry: (entry[0] is None, entry[0] or 0),
+        ))
 
         # Analyze inventory diversity by type
         type_counts = {}
-        for item in sorted_items:
+        for _, item in sorted_entries:
             item_type = item.get("type", "other")
             type_counts[item_type] = type_counts.get(item_type, 0) + 1
 
@@ -148,18 +500,12 @@ def generate_recipes():
         inventory_text = (
             "Current Inventory (sorted by expiry date - USE EARLIEST EXPIRING FIRST):\n"
         )
-        for i, item in enumerate(sorted_items, 1):
+        for i, (days, item) in enumerate(sorted_entries, 1):
             days_until_expiry = "Unknown"
-            try:
-                exp_date = datetime.strptime(
-                    item.get("expected_expiry_date", ""), "%d/%m/%Y"
-                )
-                days = (exp_date - datetime.now()).days
+            if days is not None:
                 days_until_expiry = (
                     f"{days} days" if days > 0 else "EXPIRED" if days < 0 else "TODAY"
                 )
-            except:
-                pass
 
             # Get unit and quantity for calculations
             unit = item.get('unit', 'units')
@@ -185,129 +531,46 @@ def generate_recipes():
             inventory_text += f"   - PER-UNIT nutrition (per 1 {unit.rstrip('s')}): {calories_per_unit} cal, {protein_per_unit}g protein, {carbs_per_unit}g carbs, {fats_per_unit}g fats\n"
 
         # Get user preferences if provided
-        request_data = request.get_json() or {}
         dietary_restrictions = request_data.get("dietary_restrictions", "")
         cuisine_preference = request_data.get("cuisine_preference", "")
         num_recipes = request_data.get("num_recipes", 3)
         target_calories_per_meal = request_data.get("target_calories_per_meal", 500)
 
-        # Build the prompt with nutritional and diversity requirements
-        prompt = f"""{inventory_text}
+        # With the user's goals, derive the per-meal budget from the server-side log.
+        # Once the day's budget or meals are used up (0) keep the client's target.
+        if calorie_goals:
+            remaining_per_meal = calorie_log.remaining_per_meal(
+                _current_user_id(request_data), *calorie_goals
+            )
+            if remaining_per_meal > 0:
+                target_calories_per_meal = remaining_per_meal
 
+        # Request-specific part of the prompt; the rules live in RECIPE_INSTRUCTIONS
+        prompt = f"""{inventory_text}
 Available food types in inventory: {", ".join(available_types)}
 
 TARGET CALORIES PER MEAL: ~{target_calories_per_meal} calories (user's remaining daily budget divided by meals left)
 
-Generate {num_recipes} diverse and nutritionally balanced recipe recommendations following these STRICT RULES:
-
-🔴 PRIORITY RULES (MOST IMPORTANT):
-1. **ALWAYS prioritize ingredients expiring soonest** (items listed first MUST be used first)
-2. Items expiring in 0-3 days = CRITICAL - MUST use in recipes
-3. Items expiring in 4-7 days = HIGH priority
-4. Items expiring in 8+ days = MEDIUM priority
-
-🏠 INVENTORY-ONLY REQUIREMENT:
-**AT LEAST ONE recipe MUST use ONLY ingredients from the inventory (no additional ingredients except basic seasonings like salt/pepper).**
-- Mark this recipe with "inventory_only": true
-- For this recipe, get creative with what's available in the fridge
-- You can assume basic pantry items: salt, pepper, cooking oil/butter
-- NO other additional ingredients allowed for the inventory-only recipe
-
-🥗 DIVERSITY REQUIREMENTS:
-1. Each recipe MUST use ingredients from AT LEAST 2-3 different food types (e.g., protein + vegetable + grain)
-2. Across all {num_recipes} recipes, try to use items from ALL available types: {", ".join(available_types)}
-3. Don't create recipes using only one food type (e.g., not just fruits or just vegetables)
-4. Balance macronutrients: aim for recipes with protein, carbs, and healthy fats
-
-📊 CRITICAL NUTRITIONAL CALCULATION RULES:
-**READ THIS CAREFULLY - THIS IS THE MOST IMPORTANT PART:**
-
-1. Each inventory item shows TWO nutrition values:
-   - TOTAL nutrition = for ALL units in inventory (e.g., 637 cal for 7 bananas)
-   - PER-UNIT nutrition = for ONE unit (e.g., 91 cal per 1 banana)
-
-2. **YOU MUST USE THE PER-UNIT VALUES IN YOUR CALCULATIONS!**
-   - If using 2 bananas: 2 × 91 cal = 182 cal (NOT 2 × 637 = 1274 cal!)
-   - If using 200 grams of chicken (per-unit is per 100g): 2 × per-unit value
-
-3. **CALCULATION FORMULA:**
-   ```
-   Recipe Nutrition = Σ(quantity_used × per_unit_nutrition) + additional_ingredients_nutrition
-   ```
-
-4. **EXAMPLE CALCULATION:**
-   - Recipe uses: 3 bananas + 1 cup yogurt (150 cal)
-   - Banana per-unit: 91 cal, 0g protein, 23g carbs, 0g fats
-   - Calculation: (3 × 91) + 150 = 273 + 150 = 423 total calories
-   - Final: 423 cal, 3g protein, 69g carbs, 0g fats
-
-5. **TARGET: Aim for recipes around {target_calories_per_meal} calories per serving**
-
-6. Each recipe should aim for balanced macros:
-   - Protein: 15-30g per serving
-   - Carbs: 30-60g per serving
-   - Fats: 10-25g per serving
-
-🍳 RECIPE REQUIREMENTS:
-- Use realistic quantities from inventory (don't use more than available)
-- **CRITICAL: ALWAYS include the unit when specifying quantities** (e.g., "2 items of apples" or "200 grams of chicken")
-- When listing inventory items used, show the nutrition calculation clearly
-- Instructions should be 4-8 detailed steps
-- Cooking time should be realistic (15-60 minutes)
-
+Generate {num_recipes} recipes.
 {f"⚠️ DIETARY RESTRICTIONS: {dietary_restrictions} - STRICTLY follow these restrictions!" if dietary_restrictions else ""}
-{f"🌎 CUISINE PREFERENCE: {cuisine_preference} - Try to match this style" if cuisine_preference else ""}
-
-Format your response as a JSON array. Each recipe must include accurate nutritional calculations using PER-UNIT values:
-
-[
-  {{
-    "name": "Recipe Name",
-    "inventory_only": false,
-    "inventory_items_used": [
-      "2 items of banana (182 cal from 2 × 91 cal per item, 0g protein, 46g carbs, 0g fats)",
-      "200 grams of chicken (220 cal from 2 × 110 cal per 100g, 44g protein, 0g carbs, 4g fats)"
-    ],
-    "additional_ingredients": ["1 cup yogurt (150 cal, 10g protein, 20g carbs, 2g fats)", "salt", "pepper"],
-    "instructions": ["Step 1...", "Step 2...", "Step 3...", "Step 4..."],
-    "cooking_time": "30 minutes",
-    "servings": 2,
-    "nutrition_per_serving": {{
-      "calories": 276,
-      "protein": 27,
-      "carbs": 33,
-      "fats": 3
-    }},
-    "total_nutrition": {{
-      "calories": 552,
-      "protein": 54,
-      "carbs": 66,
-      "fats": 6
-    }},
-    "food_types_used": ["protein", "fruit", "dairy"],
-    "urgency": "high",
-    "urgency_reason": "Uses bananas expiring in 6 days"
-  }}
-]
-
-URGENCY LEVELS:
-- "high" = uses items expiring within 3 days
-- "medium" = uses items expiring within 7 days  
-- "low" = uses items expiring after 7 days
-
-⚠️ CRITICAL REMINDERS:
-1. **USE PER-UNIT NUTRITION VALUES, NOT TOTAL VALUES!**
-2. Show your calculation in the inventory_items_used list (e.g., "2 × 91 cal per item")
-3. Always include units (items, grams, containers, eggs)
-4. Double-check that your total nutrition makes sense for the quantity used
-5. AT LEAST ONE recipe must have "inventory_only": true
-6. AT LEAST ONE recipe must have additional items beyond seasonings
-"""
-
-        # Call Gemini API
-        gemini_response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[{"role": "user", "parts": [{"text": prompt}]}],
+{f"🌎 CUISINE PREFERENCE: {cuisine_preference} - Try to match this style" if cuisine_preference else ""}"""
+
+        # Call Gemini API; identical in-flight prompts (double clicks, several
+        # tabs) share one call
+        fingerprint = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+        # Any worker that already answered this prompt for this bin version
+        cached_recipes = shared_cache.get("recipes", fingerprint)
+        if cached_recipes is not None:
+            return jsonify({"recipes": cached_recipes})
+
+        gemini_response = inflight.do(
+            ("recipes", fingerprint),
+            gemini.generate,
+            "recipes",
+            RECIPE_INSTRUCTIONS,
+            [{"text": prompt}],
+            size=len(items),
         )
 
         print("Gemini recipe response:")
@@ -329,8 +592,25 @@ URGENCY LEVELS:
         # Parse JSON
         recipes = json.loads(response_text)
 
-        return jsonify({"recipes": recipes})
+        # Single-bin results are tied to that bin's version; multi-bin
+        # prompts already embed every bin's inventory in the fingerprint
+        if len(records) == 1 and not failed_bins:
+            (bin_id,) = records
+            shared_cache.set(
+                "recipes", fingerprint, recipes, RECIPE_CACHE_TTL,
+                bin_id=bin_id, version=bin_versions[bin_id],
+            )
+        elif not failed_bins:
+            shared_cache.set("recipes", fingerprint, recipes, RECIPE_CACHE_TTL)
 
+        response = {"recipes": recipes}
+        if failed_bins:
+            response["failed_bins"] = failed_bins
+        return jsonify(response)
+
+    except admission.AdmissionError:
+        # Answered as a fast 429/503 by admission.handle_admission_error
+        raise
     except json.JSONDecodeError as e:
         print(f"JSON parsing error: {e}")
         return jsonify(
@@ -344,152 +624,74 @@ URGENCY LEVELS:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/calorie-tracker", methods=["GET", "POST"])
+@bp.route("/api/calorie-tracker", methods=["GET", "POST"])
 def calorie_tracker():
     """Track daily calorie consumption"""
     if request.method == "GET":
-        return jsonify({"status": "ok"})
+        user_id = _current_user_id()
+        return jsonify(
+            {
+                "status": "ok",
+                "today": calorie_log.daily_totals(user_id),
+                "week": calorie_log.weekly_totals(user_id),
+            }
+        )
 
     elif request.method == "POST":
-        data = request.get_json()
-        calories = data.get("calories", 0)
-        recipe_name = data.get("recipe_name", "Unknown")
+        meal_data = request.get_json(silent=True)
+        if not isinstance(meal_data, dict):
+            return jsonify({"status": "error", "error": "Expected a JSON object"}), 400
+        recipe_name = meal_data.get("recipe_name", "Unknown")
+        user_id = _current_user_id(meal_data)
 
-        print(f"Logged consumption: {recipe_name} - {calories} calories")
+        try:
+            entry = calorie_log.append(user_id, recipe_name, meal_data, source="manual")
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
 
         return jsonify(
             {
                 "status": "success",
-                "message": f"Logged {calories} calories from {recipe_name}",
+                "message": f"Logged {entry['calories']} calories from {recipe_name}",
+                "today": calorie_log.daily_totals(user_id),
             }
         )
 
 
-@app.route("/analyze", methods=["POST"])
+@bp.route("/api/gemini-stats")
+def gemini_stats():
+    """Per-route Gemini token counts, model tiers used and latency, plus the admission queue."""
+    return jsonify(dict(gemini.stats(), admission=admission.gemini_limiter.stats()))
+
+
+@bp.route("/api/cache-stats")
+def cache_stats():
+    """Shared cache hit/miss counts seen by this worker."""
+    return jsonify(shared_cache.stats())
+
+
+@bp.route("/analyze", methods=["POST"])
 def analyze():
-    prompt = f"""Analyze this food image and return the data as a Python dictionary. Follow these guidelines carefully:
-
-    CRITICAL FORMATTING RULES:
-    - Return ONLY valid JSON format within a Python dictionary structure
-    - Use the exact field names and structure shown in the example
-    - All numerical values must be integers (no decimals, no quotes)
-
-    DATA REQUIREMENTS:
-
-    1. NAME: Use common food names (e.g., "coca cola" not "Coca-Cola 330ml can")
-
-    2. TYPE: Choose from: "fruit", "vegetable", "protein", "grains", "dairy", "beverage", "snacks", "condiments"
-
-    3. QUANTITY AND UNITS:
-    - quantity: Always an integer number
-    - unit: Choose from these exact options:
-        * "items" - for individual pieces (fruits, vegetables, packaged items)
-        * "grams" - for meat, cheese, bulk foods
-        * "containers" - for bottles, cans, cartons, packages
-        * "eggs" - specifically for eggs
-
-    RULES:
-    - For SOLID items: count individual pieces → unit: "items" (e.g., 6 apples)
-    - For LIQUIDS/BEVERAGES: count containers → unit: "containers" (e.g., 2 bottles of soda)
-    - For MEAT/PROTEINS: use grams → unit: "grams" (e.g., 500g chicken)
-    - For EGGS: use count → unit: "eggs" (e.g., 12 eggs)
-    - NEVER use volume measurements (no ml, liters, cups, etc.)
-
-    4. EXPIRY DATE: 
-    - **TODAY'S DATE IS: {today_date} - USE THIS AS PURCHASE DATE**
-    - Calculate expiry dates based on TODAY being the purchase date
-    - Assume refrigerator storage for perishable items
-    - Use DD/MM/YYYY format
-    - Research realistic shelf life for each food type:
-        * Fresh fruits: 3-7 days from today
-        * Fresh vegetables: 5-10 days from today  
-        * Raw meat/fish: 2-3 days from today
-        * Dairy: 7-14 days from today
-        * Beverages: 30-180 days from today
-        * Packaged snacks: 90-365 days from today
-
-    5. NUTRITION (per entire quantity shown):
-    - calories: total calories for the quantity shown
-    - carbs: total carbohydrates in grams
-    - fats: total fat in grams  
-    - protein: total protein in grams
-    - All values must be integers representing the TOTAL for the quantity
-
-    UNIT SPECIFIC EXAMPLES:
-    - 6 apples → quantity: 6, unit: "items"
-    - 2 bottles of milk → quantity: 2, unit: "containers" 
-    - 500g chicken → quantity: 500, unit: "grams"
-    - 12 eggs → quantity: 12, unit: "eggs"
-    - 1 can of soda → quantity: 1, unit: "containers"
-    - 3 bananas → quantity: 3, unit: "items"
-
-    EXAMPLE OUTPUT FORMAT:
-    {{
-        "inventory": [
-            {{
-                "name": "orange",
-                "type": "fruit", 
-                "quantity": 6,
-                "unit": "items",
-                "expected_expiry_date": "{today_date}",
-                "calories": 372,
-                "carbs": 93,
-                "fats": 0,
-                "protein": 0
-            }},
-            {{
-                "name": "coca cola", 
-                "type": "beverage",
-                "quantity": 4,
-                "unit": "containers",
-                "expected_expiry_date": "15/12/2025",
-                "calories": 560,
-                "carbs": 140,
-                "fats": 0,
-                "protein": 0
-            }},
-            {{
-                "name": "chicken breast",
-                "type": "protein",
-                "quantity": 500,
-                "unit": "grams",
-                "expected_expiry_date": "05/12/2024",
-                "calories": 825,
-                "carbs": 0,
-                "fats": 18,
-                "protein": 100
-            }},
-            {{
-                "name": "eggs",
-                "type": "protein", 
-                "quantity": 12,
-                "unit": "eggs",
-                "expected_expiry_date": "25/11/2024",
-                "calories": 840,
-                "carbs": 0,
-                "fats": 60,
-                "protein": 72
-            }}
-        ]
-    }}
-
-    IMPORTANT: 
-    - Today's purchase date is {today_date} - calculate all expiry dates from this date
-    - Be realistic with expiry dates based on common food shelf life
-    - Ensure dates are chronologically logical (expiry dates must be AFTER today)
-    - Use the exact unit values: "items", "grams", "containers", or "eggs" """
+    # Computed per request so long-running workers never use a stale date
+    today = datetime.now()
+
+    # change TEST_BIN_ID to BIN_ID for actual use
+    admission.check_rate_limits(
+        admission.client_address(), [TEST_BIN_ID], request.headers.get("X-User-Id")
+    )
+
     image_url = request.form.get("image_url")
     image_file = request.files.get("image_file")
 
     print(f"DEBUG - Received image_url: {image_url}")
     print(f"DEBUG - Received image_file: {image_file}")
 
-    parts = [{"text": prompt}]
+    parts = []
 
     if image_url:
         print(f"DEBUG - Attempting to fetch URL: {image_url}")
         try:
-            response = requests.get(image_url, timeout=10)
+            response = clients.get_http_session().get(image_url, timeout=10)
             response.raise_for_status()
             print(
                 f"DEBUG - Successfully fetched image, size: {len(response.content)} bytes"
@@ -515,18 +717,99 @@ def analyze():
         print("DEBUG - No image provided")
         return jsonify({"error": "No image provided"}), 400
 
-    gemini_response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[{"role": "user", "parts": parts}],
-    )
-    print(gemini_response.text)
+    # Images any worker has already analyzed come from the shared cache;
+    # identical images analyzed concurrently share one Gemini call
+    image_data = parts[0]["inline_data"]["data"]
+    image_hash = hashlib.sha256(image_data).hexdigest()
+
+    detected_text = shared_cache.get("analyze", image_hash)
+    from_cache = detected_text is not None
+    if not from_cache:
+        gemini_response = inflight.do(
+            ("analyze", image_hash),
+            gemini.generate,
+            "analyze",
+            ANALYZE_INSTRUCTIONS,
+            parts,
+            size=len(image_data),
+        )
+        detected_text = gemini_response.text
+    print(detected_text)
+
+    detected = data.parse_gemini_inventory_output(detected_text)
+    if not detected or not isinstance(detected.get("inventory"), list):
+        return jsonify({"error": "Failed to parse inventory", "raw_response": detected_text}), 500
+
+    if not from_cache:
+        shared_cache.set("analyze", image_hash, detected_text, ANALYZE_CACHE_TTL)
+
+    unknown_items = nutrition.enrich_inventory(detected["inventory"], today)
+    if unknown_items:
+        print(f"{len(unknown_items)} item(s) not in reference table, asking Gemini")
+        _estimate_unknown_items(unknown_items, today)
 
     # change TEST_BIN_ID to BIN_ID for actual use
-    data.store_data_to_bin(
-        data.parse_gemini_inventory_output(gemini_response.text), TEST_BIN_ID
+    data.store_data_to_bin(detected, TEST_BIN_ID)
+
+    return jsonify({"response": json.dumps(detected)})
+
+
+def _estimate_unknown_items(items, today):
+    """
+    Fallback for foods missing from the reference table: asks Gemini (text only)
+    for total nutrition and shelf life of just those items, filling them in place.
+    """
+    item_lines = "\n".join(
+        f"{i}. {item.get('name', 'Unknown')} - {item.get('quantity', 1)} {item.get('unit', 'items')}"
+        for i, item in enumerate(items, 1)
     )
+    gemini_response = gemini.generate(
+        "estimate", ESTIMATE_INSTRUCTIONS, [{"text": item_lines}], size=len(items)
+    )
+    print(gemini_response.text)
+
+    estimates = data.parse_gemini_inventory_output(gemini_response.text)
+    if not isinstance(estimates, dict) or not isinstance(estimates.get("inventory"), list):
+        print("Warning: Unexpected estimate format, using defaults.")
+        estimates = {"inventory": []}
+
+    for item, estimate in zip(items, estimates["inventory"]):
+        if not isinstance(estimate, dict):
+            continue
+        totals, shelf_days = nutrition.parse_estimate(estimate)
+        item.update(totals)
+        item["expected_expiry_date"] = nutrition.expiry_from_shelf_life(shelf_days, today)
+
+    # Anything Gemini skipped still gets a conservative expiry so the
+    # inventory never holds items without a date.
+    for item in items:
+        item.setdefault(
+            "expected_expiry_date", nutrition.expiry_from_shelf_life(nutrition.DEFAULT_SHELF_DAYS, today)
+        )
+        for field in nutrition.NUTRITION_FIELDS:
+            item.setdefault(field, 0)
+
+
+def create_app():
+    """
+    Application factory. Only registers routes (.env is loaded at import
+    time, above); the Gemini client and HTTP session are created lazily on first use
+    (see clients.py), so startup stays cheap for every worker spawn.
+    """
+    start = time.perf_counter()
+
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    profiling.init_app(app)
+    app.register_error_handler(admission.AdmissionError, admission.handle_admission_error)
+
+    expiry_index.start_background_scan()
+
+    print(f"App created in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return app
+
 
-    return jsonify({"response": gemini_response.text})
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+"""
+Measures cold-start cost of the app: the time a fresh Python process needs to
+import app.py (which builds the app via create_app()) and serve its first
+template-only request. Each run uses a new interpreter so nothing is cached.
+
+Usage: python bench_startup.py [runs]
+"""
+import statistics
+import subprocess
+import sys
+import os
+
+CHILD = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.app.test_client().get("/settings")
+t2 = time.perf_counter()
+import sys
+print(f"{(t1 - t0) * 1000:.2f} {(t2 - t1) * 1000:.2f} {int('google.genai' in sys.modules)}")
+"""
+
+
+def run_once():
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip().splitlines()[-1]
+    import_ms, first_request_ms, genai_loaded = out.split()
+    return float(import_ms), float(first_request_ms), genai_loaded == "1"
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for _ in range(runs)]
+
+    import_times = [r[0] for r in results]
+    request_times = [r[1] for r in results]
+
+    print(f"Runs: {runs}")
+    print(f"Import + create_app: median {statistics.median(import_times):.1f} ms "
+          f"(min {min(import_times):.1f}, max {max(import_times):.1f})")
+    print(f"First template request: median {statistics.median(request_times):.1f} ms")
+    print(f"google.genai imported during startup: {any(r[2] for r in results)}")
@@ -0,0 +1,152 @@
+import json
+import os
+from typing import Optional, Dict, List, Any, Iterator, IO
+
+import data
+from expiry_index import expiry_ordinal
+
+# =================================================================
+# Streaming NDJSON import/export of inventories (one food item per line).
+# Export serializes the bin one item at a time into the response stream.
+# Import reads the request body line by line and validates each row, so the
+# raw body is never held in memory; the validated rows are buffered in one
+# list, because JSONBin only supports whole-document writes and the bin is
+# written once per import (append or replace). That buffer is bounded by
+# IMPORT_MAX_ROWS and IMPORT_MAX_BYTES: an import that goes over either stops
+# reading right there and nothing is written (413), rather than building a
+# document JSONBin would reject anyway.
+# =================================================================
+MAX_LINE_BYTES = 64 * 1024
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+# Largest document an import may write to a bin; keep within your JSONBin plan's bin size limit
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(1024 * 1024)))
+MAX_REPORTED_ERRORS = 100
+
+VALID_UNITS = {"items", "grams", "containers", "eggs"}
+NUMERIC_FIELDS = ("quantity", "calories", "carbs", "fats", "protein")
+
+
+def validate_item(item: Any) -> Optional[str]:
+    """Returns why a row is not a valid inventory item, or None if it is."""
+    if not isinstance(item, dict):
+        return "row is not a JSON object"
+    if not isinstance(item.get("name"), str) or not item["name"].strip():
+        return "missing or empty 'name'"
+    if "quantity" not in item:
+        return "missing 'quantity'"
+    for field in NUMERIC_FIELDS:
+        value = item.get(field)
+        if field in item and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            return f"'{field}' must be a non-negative number"
+    if "unit" in item and item["unit"] not in VALID_UNITS:
+        return f"'unit' must be one of {sorted(VALID_UNITS)}"
+    if "expected_expiry_date" in item and expiry_ordinal(item["expected_expiry_date"]) is None:
+        return "'expected_expiry_date' must be DD/MM/YYYY"
+    return None
+
+
+def export_ndjson(inventory: List[Dict[str, Any]]) -> Iterator[str]:
+    """Yields the inventory as NDJSON, one item per chunk of the response."""
+    for item in inventory:
+        yield json.dumps(item) + "\n"
+
+
+def _iter_lines(stream: IO[bytes]) -> Iterator[bytes]:
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        yield line
+
+
+def import_ndjson(bin_id: str, stream: IO[bytes], mode: str = "append",
+                  allow_empty: bool = False) -> Dict[str, Any]:
+    """
+    Imports NDJSON rows from a byte stream into a bin.
+
+    Args:
+        bin_id: The bin to import into.
+        stream: The request body stream.
+        mode: "append" adds rows to the existing inventory, "replace" overwrites it.
+        allow_empty: Let "replace" with no valid rows empty the bin. Never
+            applies when rows were rejected.
+
+    Returns:
+        A report with counts of imported and rejected rows and the first
+        MAX_REPORTED_ERRORS errors (by line number). "success" is False if
+        the bin could not be read or written; "refused" is also set when
+        nothing was written because a replace would have emptied the bin,
+        and "too_large" when the import went over IMPORT_MAX_ROWS or
+        IMPORT_MAX_BYTES.
+    """
+    imported: List[Dict[str, Any]] = []
+    imported_bytes = 0
+    errors: List[Dict[str, Any]] = []
+    rejected = 0
+
+    def too_large(reason: str) -> Dict[str, Any]:
+        print(f"   Import into {bin_id} refused: {reason}")
+        return {"imported": 0, "rejected": rejected, "errors": errors, "mode": mode,
+                "success": False, "too_large": True, "error": reason}
+
+    def reject(line_number: int, reason: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": line_number, "error": reason})
+
+    for line_number, raw_line in enumerate(_iter_lines(stream), 1):
+        if len(raw_line) > MAX_LINE_BYTES:
+            reject(line_number, f"line longer than {MAX_LINE_BYTES} bytes")
+            # Skip the rest of the oversized line
+            while raw_line and not raw_line.endswith(b"\n"):
+                raw_line = stream.readline(MAX_LINE_BYTES)
+            continue
+
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            reject(line_number, f"invalid JSON: {e}")
+            continue
+
+        reason = validate_item(item)
+        if reason:
+            reject(line_number, reason)
+            continue
+
+        imported.append(item)
+        imported_bytes += len(line)
+        if len(imported) > IMPORT_MAX_ROWS:
+            return too_large(f"more than {IMPORT_MAX_ROWS} rows")
+        if imported_bytes > IMPORT_MAX_BYTES:
+            return too_large(f"more than {IMPORT_MAX_BYTES} bytes of rows")
+
+    report = {"imported": len(imported), "rejected": rejected, "errors": errors, "mode": mode}
+
+    if not imported:
+        if mode == "append":
+            return dict(report, success=True)
+        if rejected or not allow_empty:
+            print(f"   Import into {bin_id} refused: replace with no valid rows")
+            return dict(report, success=False, refused=True,
+                        error="No valid rows; refusing to replace the inventory with an empty one")
+
+    if mode == "append":
+        record = data.read_data_from_bin(bin_id, fresh=True)
+        if record is None:
+            return dict(report, success=False, imported=0, error="Failed to read existing data")
+        record.setdefault("inventory", []).extend(imported)
+        if len(json.dumps(record)) > IMPORT_MAX_BYTES:
+            return too_large(f"inventory would exceed {IMPORT_MAX_BYTES} bytes")
+    else:
+        record = {"inventory": imported}
+
+    if not data.replace_data_in_bin(bin_id, record):
+        return dict(report, success=False, imported=0, error="Failed to write imported data")
+
+    print(f"   Import into {bin_id} done: {len(imported)} imported, {rejected} rejected")
+    return dict(report, success=True)
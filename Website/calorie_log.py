@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+
+from nutrition import NUTRITION_FIELDS, parse_nutrition
+
+# =================================================================
+# Server-side calorie log.
+# Every logged meal is appended as one JSON line to a per-user file
+# (CALORIE_LOG_DIR/<sha256 of user id>.jsonl); entries are never rewritten. Daily and
+# weekly totals are kept in memory and updated incrementally as entries are
+# appended, so reading them is a dict lookup. Each user's file is replayed
+# from the last seen offset before a read, which also picks up entries
+# appended by other worker processes.
+# =================================================================
+LOG_DIR = os.getenv(
+    "CALORIE_LOG_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "calorie_logs"),
+)
+
+
+def _empty_totals() -> Dict[str, float]:
+    totals = {field: 0 for field in NUTRITION_FIELDS}
+    totals["meals"] = 0
+    return totals
+
+
+def _week_key(day: datetime) -> Tuple[int, int]:
+    year, week, _ = day.isocalendar()
+    return year, week
+
+
+class _UserAggregates:
+    """Rolling totals for one user, plus how far into their log file we have read."""
+
+    def __init__(self):
+        self.offset = 0
+        self.daily: Dict[str, Dict[str, float]] = {}
+        self.weekly: Dict[Tuple[int, int], Dict[str, float]] = {}
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        logged_at = datetime.fromisoformat(entry["logged_at"])
+        for totals in (
+            self.daily.setdefault(logged_at.strftime("%d/%m/%Y"), _empty_totals()),
+            self.weekly.setdefault(_week_key(logged_at), _empty_totals()),
+        ):
+            for field in NUTRITION_FIELDS:
+                totals[field] += entry.get(field, 0) or 0
+            totals["meals"] += 1
+
+
+class CalorieLog:
+    def __init__(self, log_dir: str = LOG_DIR):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self._users: Dict[str, _UserAggregates] = {}
+
+    def _path(self, user_id: str) -> str:
+        # Hashed so distinct ids never share a file, whatever characters they use
+        file_id = hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.log_dir, f"{file_id}.jsonl")
+
+    def _catch_up(self, user_id: str) -> _UserAggregates:
+        """Applies any entries appended to the user's file since the last read. Caller holds the lock."""
+        aggregates = self._users.setdefault(user_id, _UserAggregates())
+        path = self._path(user_id)
+
+        if not os.path.exists(path) or os.path.getsize(path) == aggregates.offset:
+            return aggregates
+
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(aggregates.offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    # Partially written line from a concurrent writer; read it next time
+                    break
+                aggregates.offset += len(line.encode("utf-8"))
+                try:
+                    aggregates.add(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    print(f"Warning: Skipping malformed calorie log entry: {e}")
+
+        return aggregates
+
+    def append(self, user_id: str, name: str, nutrition: Dict[str, Any],
+               source: str = "manual", logged_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Appends a meal to the user's log and updates the rolling totals.
+
+        Args:
+            user_id: Whose log to write to.
+            name: Meal or recipe name.
+            nutrition: Totals for the meal, keys from NUTRITION_FIELDS.
+            source: Where the entry came from ("consume" or "manual").
+
+        Returns:
+            The stored entry.
+
+        Raises:
+            ValueError: A nutrition value is not a non-negative number
+                (see parse_nutrition); nothing is logged.
+        """
+        entry = {
+            "logged_at": (logged_at or datetime.now()).isoformat(timespec="seconds"),
+            "name": name,
+            "source": source,
+        }
+        entry.update(parse_nutrition(nutrition))
+
+        with self._lock:
+            os.makedirs(self.log_dir, exist_ok=True)
+            aggregates = self._catch_up(user_id)
+            line = json.dumps(entry) + "\n"
+            with open(self._path(user_id), "a", encoding="utf-8") as f:
+                f.write(line)
+            # Only advance past our own line if nobody else wrote in between
+            if os.path.getsize(self._path(user_id)) == aggregates.offset + len(line.encode("utf-8")):
+                aggregates.offset += len(line.encode("utf-8"))
+                aggregates.add(entry)
+            else:
+                self._catch_up(user_id)
+
+        print(f"Logged consumption for {user_id}: {name} - {entry['calories']} calories")
+        return entry
+
+    def daily_totals(self, user_id: str, day: Optional[datetime] = None) -> Dict[str, float]:
+        """Returns calorie and macro totals for the given day (default today)."""
+        day = day or datetime.now()
+        with self._lock:
+            totals = self._catch_up(user_id).daily.get(day.strftime("%d/%m/%Y"))
+            return dict(totals) if totals else _empty_totals()
+
+    def weekly_totals(self, user_id: str, day: Optional[datetime] = None) -> Dict[str, float]:
+        """Returns calorie and macro totals for the ISO week containing the given day."""
+        day = day or datetime.now()
+        with self._lock:
+            totals = self._catch_up(user_id).weekly.get(_week_key(day))
+            return dict(totals) if totals else _empty_totals()
+
+    def remaining_per_meal(self, user_id: str, daily_calories: int, daily_meals: int) -> int:
+        """
+        Mirrors CalorieTracker.getCaloriesPerMeal() in calorie-tracker.js using
+        the server-side log: remaining daily budget divided by meals left.
+        """
+        today = self.daily_totals(user_id)
+        remaining = daily_calories - today["calories"]
+        meals_left = max(0, daily_meals - today["meals"])
+        if meals_left == 0 or remaining <= 0:
+            return 0
+        return round(remaining / meals_left)
+
+
+calorie_log = CalorieLog()
@@ -0,0 +1,39 @@
+import os
+import threading
+
+# =================================================================
+# Lazily created, process-wide clients.
+# The Gemini SDK and requests are only imported the first time a route
+# actually needs them, so template-only requests and cold starts never pay
+# for SDK import or client setup. Once created, clients are reused across
+# requests (keeps HTTP connections alive to JSONBin / Gemini).
+# =================================================================
+
+_lock = threading.Lock()
+_gemini_client = None
+_http_session = None
+
+
+def get_gemini_client():
+    """Returns the shared genai.Client, creating it on first use."""
+    global _gemini_client
+    if _gemini_client is None:
+        with _lock:
+            if _gemini_client is None:
+                from google import genai
+
+                _gemini_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+                print("Gemini client initialized.")
+    return _gemini_client
+
+
+def get_http_session():
+    """Returns the shared requests.Session, creating it on first use."""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                import requests
+
+                _http_session = requests.Session()
+    return _http_session
@@ -1,7 +1,14 @@
-import requests
+import copy
 import json
+import os
+import sys
 from typing import Optional, Dict, List, Any, Tuple
-from datetime import datetime
+
+import clients
+from expiry_index import expiry_index, expiry_ordinal
+from nutrition import NUTRITION_FIELDS
+from shared_cache import shared_cache
+from singleflight import inflight
 
 # =================================================================
 # IMPORTANT CONFIGURATION
@@ -11,17 +18,25 @@ from datetime import datetime
 MASTER_KEY = "$2a$10$1JnkDOp7Tc3LAEWBU2ecie3nZWb/4wHlADCzhV0L4xSD3lkjNSYuC"
 BASE_URL = "https://api.jsonbin.io/v3/b"
 
+# How long a bin read is served from the shared cache. Writes through this app
+# invalidate immediately; this only bounds staleness for edits made elsewhere.
+BIN_CACHE_TTL = int(os.getenv("BIN_CACHE_TTL", "30"))
+
+# Upper bound on concurrent JSONBin GETs issued by one read_data_from_bins call
+MULTI_BIN_MAX_WORKERS = int(os.getenv("MULTI_BIN_MAX_WORKERS", "4"))
+
 
 # --- Utility Function for Expiry Date Sorting ---
 
-def _parse_expiry_date(date_str: str) -> datetime:
-    """Converts a DD/MM/YYYY string to a datetime object for sorting."""
-    try:
-        return datetime.strptime(date_str, "%d/%m/%Y")
-    except (ValueError, TypeError):
+def _expiry_sort_key(item: Dict[str, Any]) -> int:
+    """Returns the (cached) date ordinal of an item's DD/MM/YYYY expiry for sorting."""
+    date_str = item.get('expected_expiry_date', '')
+    ordinal = expiry_ordinal(date_str)
+    if ordinal is None:
         # If parsing fails, treat it as the maximum date (i.e., expire last)
         print(f"Warning: Could not parse date '{date_str}'. Treating as last to expire.")
-        return datetime.max
+        return sys.maxsize
+    return ordinal
 
 
 def parse_gemini_inventory_output(raw_text: str) -> dict or None:
@@ -46,11 +61,96 @@ def parse_gemini_inventory_output(raw_text: str) -> dict or None:
         return None
 # --- Core JSONBin Functions ---
 
-def read_data_from_bin(bin_id: str) -> Optional[Dict[str, Any]]:
+def read_data_from_bin(bin_id: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
     """
     Retrieves the JSON data (the record dictionary containing "inventory")
     from a specified public bin.
+
+    Reads are served from the host-wide shared cache when it holds the bin's
+    current version. Otherwise concurrent reads of the same bin share one GET;
+    each caller gets its own copy since callers mutate the record.
+
+    Args:
+        bin_id: The bin to read.
+        fresh: Always GET from JSONBin, bypassing the cache and any in-flight
+            read. Use for reads that feed a write, so edits made outside
+            this host (other hosts, the JSONBin UI) are not overwritten.
+    """
+    version = shared_cache.bin_version(bin_id)
+
+    if fresh:
+        record = _fetch_bin(bin_id)
+    else:
+        record = shared_cache.get("bin", bin_id)
+        if record is not None:
+            if not expiry_index.is_current(bin_id, version):
+                expiry_index.update(bin_id, record.get("inventory", []), version)
+            return record
+        record = inflight.do(("bin", bin_id), _fetch_bin, bin_id)
+
+    if record is not None:
+        shared_cache.set("bin", bin_id, record, BIN_CACHE_TTL, bin_id=bin_id, version=version)
+        expiry_index.update(bin_id, record.get("inventory", []), version)
+    return copy.deepcopy(record)
+
+
+def read_data_from_bins(bin_ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Reads several bins concurrently, with at most MULTI_BIN_MAX_WORKERS
+    requests in flight at once. A single bin is read on the calling thread,
+    so request profiles still see the JSONBin call.
+
+    Returns:
+        (records keyed by bin id, ids of bins that could not be read)
+    """
+    unique_ids = list(dict.fromkeys(bin_ids))
+
+    if len(unique_ids) <= 1:
+        results = [read_data_from_bin(bin_id) for bin_id in unique_ids]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max(1, min(MULTI_BIN_MAX_WORKERS, len(unique_ids)))) as pool:
+            results = list(pool.map(read_data_from_bin, unique_ids))
+
+    records: Dict[str, Dict[str, Any]] = {}
+    failed: List[str] = []
+    for bin_id, record in zip(unique_ids, results):
+        if record is None:
+            failed.append(bin_id)
+        else:
+            records[bin_id] = record
+
+    return records, failed
+
+
+def refresh_expiry_index(bin_id: str) -> bool:
+    """
+    Makes sure this worker's expiry index holds the bin's current shared
+    version, re-reading the bin if another worker has written it since.
+
+    Returns:
+        False if the bin had to be read and could not be.
+    """
+    if expiry_index.is_current(bin_id, shared_cache.bin_version(bin_id)):
+        return True
+    return read_data_from_bin(bin_id) is not None
+
+
+def _after_write(bin_id: str, record: Dict[str, Any]) -> None:
+    """
+    Publishes a successful write: bumps the bin's shared version (invalidating
+    every worker's cached copies), caches the new record and reindexes it.
     """
+    version = shared_cache.bump_bin_version(bin_id)
+    shared_cache.set("bin", bin_id, record, BIN_CACHE_TTL, bin_id=bin_id, version=version)
+    expiry_index.update(bin_id, record.get("inventory", []), version)
+
+
+def _fetch_bin(bin_id: str) -> Optional[Dict[str, Any]]:
+    """Performs the actual JSONBin GET for read_data_from_bin."""
+    from requests.exceptions import HTTPError
+
     url = f"{BASE_URL}/{bin_id}"
     print(f"\n-> Attempting to READ data from bin: {bin_id}")
 
@@ -59,7 +159,7 @@ def read_data_from_bin(bin_id: str) -> Optional[Dict[str, Any]]:
         'X-Master-Key': MASTER_KEY
     }
 
-    response = requests.get(url, headers=headers)
+    response = clients.get_http_session().get(url, headers=headers)
 
     try:
         response.raise_for_status()
@@ -67,7 +167,7 @@ def read_data_from_bin(bin_id: str) -> Optional[Dict[str, Any]]:
         print("   Success! Data retrieved.")
         return result.get('record')
 
-    except requests.exceptions.HTTPError as err:
+    except HTTPError as err:
         print(f"   API Error occurred during read: {err}")
         return None
     except Exception as e:
@@ -93,6 +193,10 @@ def store_data_to_bin(data: Dict[str, List[Dict[str, Any]]], bin_id: Optional[st
         print("ERROR: Please update the MASTER_KEY variable with your actual key.")
         return None
 
+    from requests.exceptions import HTTPError
+
+    session = clients.get_http_session()
+
     headers = {
         'Content-Type': 'application/json',
         'X-Master-Key': MASTER_KEY,
@@ -104,7 +208,7 @@ def store_data_to_bin(data: Dict[str, List[Dict[str, Any]]], bin_id: Optional[st
     if bin_id:
         # Case 1: ADDITIVE UPDATE (Read -> Merge -> Write)
 
-        existing_data_wrapper = read_data_from_bin(bin_id)
+        existing_data_wrapper = read_data_from_bin(bin_id, fresh=True)
 
         if existing_data_wrapper is None:
             print("   Failed to read existing data. Aborting merge update.")
@@ -122,13 +226,13 @@ def store_data_to_bin(data: Dict[str, List[Dict[str, Any]]], bin_id: Optional[st
         # WRITE the MERGED data back (PUT request)
         url = f"{BASE_URL}/{bin_id}"
         print(f"-> Attempting to WRITE merged data back to bin: {bin_id}")
-        response = requests.put(url, headers=headers, data=json.dumps(final_data_to_store))
+        response = session.put(url, headers=headers, data=json.dumps(final_data_to_store))
 
     else:
         # Case 2: CREATE new bin (POST request)
         url = BASE_URL
         print("-> Attempting to CREATE new bin.")
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = session.post(url, headers=headers, data=json.dumps(data))
 
     try:
         response.raise_for_status()
@@ -136,13 +240,15 @@ def store_data_to_bin(data: Dict[str, List[Dict[str, Any]]], bin_id: Optional[st
 
         if bin_id:
             print(f"   Success! Bin {bin_id} updated successfully with merged data.")
+            _after_write(bin_id, final_data_to_store)
             return None
         else:
             new_id = result['metadata']['id']
             print(f"   Success! New bin created with ID: {new_id}")
+            _after_write(new_id, data)
             return new_id
 
-    except requests.exceptions.HTTPError as err:
+    except HTTPError as err:
         print(f"   API Error occurred: {err}")
         return None
     except Exception as e:
@@ -150,26 +256,58 @@ def store_data_to_bin(data: Dict[str, List[Dict[str, Any]]], bin_id: Optional[st
         return None
 
 
+def replace_data_in_bin(bin_id: str, record: Dict[str, Any]) -> bool:
+    """
+    Overwrites a bin with the given record (PUT, no merge) and publishes
+    the write to the shared cache and expiry index.
+
+    Returns:
+        True on success, False if the write failed.
+    """
+    url = f"{BASE_URL}/{bin_id}"
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Master-Key': MASTER_KEY
+    }
+
+    response = clients.get_http_session().put(url, headers=headers, data=json.dumps(record))
+
+    try:
+        response.raise_for_status()
+    except Exception as e:
+        print(f"   API Error occurred during write: {e}")
+        return False
+
+    _after_write(bin_id, record)
+    return True
+
+
 # --- NEW FUNCTION FOR CONSUMPTION ---
 
-def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> None:
+def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Subtracts consumed amounts from the inventory, prioritizing items
     with the earliest expiry date (FIFO). Uses case-insensitive matching.
+    Stored nutrition totals of partially consumed batches shrink in
+    proportion to the quantity taken.
 
     Args:
         bin_id: The ID of the bin to update.
         consumed_map: A dictionary mapping food name to consumed amount (e.g., {"apple": 2}).
+
+    Returns:
+        {"consumed": {name: amount}, "nutrition": {calories, protein, carbs, fats}}
+        for what was actually taken, or None if the bin could not be read or written.
     """
     print("\n" + "=" * 80)
     print(f"STARTING CONSUMPTION LOGIC for bin: {bin_id}")
     print("=" * 80)
 
     # 1. READ existing data
-    existing_data_wrapper = read_data_from_bin(bin_id)
+    existing_data_wrapper = read_data_from_bin(bin_id, fresh=True)
     if existing_data_wrapper is None:
         print("❌ Error: Could not retrieve data for consumption.")
-        return
+        return None
 
     # Get the mutable inventory list
     inventory: List[Dict[str, Any]] = existing_data_wrapper.get("inventory", [])
@@ -183,6 +321,7 @@ def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> None:
     
     # Track what was actually consumed for reporting
     actually_consumed = {}
+    consumed_nutrition = {field: 0 for field in NUTRITION_FIELDS}
 
     # 2. Process Consumption for Each Item Type
     for item_name, amount_to_consume in consumed_map.items():
@@ -207,7 +346,7 @@ def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> None:
             continue
 
         # Sort by earliest expiry date (using the custom parse function)
-        matching_entries.sort(key=lambda item: _parse_expiry_date(item.get('expected_expiry_date', '')))
+        matching_entries.sort(key=_expiry_sort_key)
         
         # Debug: show what we found
         for idx, entry in enumerate(matching_entries):
@@ -233,6 +372,15 @@ def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> None:
                 items_to_keep.append(entry)
                 continue
 
+            # Nutrition leaves the batch in proportion to the quantity taken
+            taken = min(quantity, current_consumed)
+            for field in NUTRITION_FIELDS:
+                value = entry.get(field)
+                if isinstance(value, (int, float)):
+                    share = value * taken / quantity
+                    consumed_nutrition[field] += share
+                    entry[field] = round(value - share)
+
             # Consumption logic
             if quantity >= current_consumed:
                 # Consumed amount is less than or equal to current entry quantity
@@ -293,25 +441,21 @@ def consume_data_from_bin(bin_id: str, consumed_map: Dict[str, Any]) -> None:
         print(f"  • {name}: {amount} units")
     print(f"{'=' * 80}\n")
 
-    url = f"{BASE_URL}/{bin_id}"
     print("-> FINAL STEP: Writing updated inventory back to server...")
 
-    headers = {
-        'Content-Type': 'application/json',
-        'X-Master-Key': MASTER_KEY
-    }
-
-    # We use requests.put directly here to avoid re-reading the data inside store_data_to_bin
-    response = requests.put(url, headers=headers, data=json.dumps(final_data_to_store))
-
-    try:
-        response.raise_for_status()
-        print(f"   ✅ Success! Bin {bin_id} updated after consumption.")
-    except Exception as e:
-        print(f"   ❌ Error during final update: {e}")
+    # We replace directly here to avoid re-reading the data inside store_data_to_bin
+    if not replace_data_in_bin(bin_id, final_data_to_store):
+        print("   ❌ Error during final update.")
+        return None
+    print(f"   ✅ Success! Bin {bin_id} updated after consumption.")
 
     print("=" * 80 + "\n")
 
+    return {
+        "consumed": actually_consumed,
+        "nutrition": {field: round(value) for field, value in consumed_nutrition.items()},
+    }
+
 
 # Example Usage
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Dict, List, Any, Tuple
+
+# =================================================================
+# Day-bucketed expiry index.
+# For every bin we know about, items are grouped into buckets keyed by the
+# date ordinal of their expected_expiry_date, with a sorted list of the
+# occupied days. "Expiring within N days" and "already expired" are then a
+# bisect plus a walk over the matching buckets, proportional to the result.
+# The index is refreshed whenever data.py reads or writes a bin, and a
+# background thread periodically recomputes each bin's urgency list.
+# =================================================================
+SCAN_INTERVAL_SECONDS = int(os.getenv("EXPIRY_SCAN_INTERVAL", "3600"))
+
+# Urgency bands, matching the priority rules in the recipe prompt
+CRITICAL_DAYS = 3
+HIGH_DAYS = 7
+
+
+@lru_cache(maxsize=4096)
+def expiry_ordinal(date_str: str) -> Optional[int]:
+    """Returns the date ordinal of a DD/MM/YYYY string, or None if it cannot be parsed."""
+    try:
+        return datetime.strptime(date_str, "%d/%m/%Y").toordinal()
+    except (ValueError, TypeError):
+        return None
+
+
+class BinExpiryIndex:
+    """Expiry buckets for one bin's inventory."""
+
+    def __init__(self, inventory: List[Dict[str, Any]]):
+        self.buckets: Dict[int, List[Dict[str, Any]]] = {}
+        self.undated: List[Dict[str, Any]] = []
+
+        for item in inventory:
+            ordinal = expiry_ordinal(item.get("expected_expiry_date", ""))
+            if ordinal is None:
+                self.undated.append(item)
+            else:
+                self.buckets.setdefault(ordinal, []).append(item)
+
+        self.days: List[int] = sorted(self.buckets)
+        # Hash of the inventory this index was built from, set by ExpiryIndex.update
+        self.fingerprint: Optional[str] = None
+
+    def _range(self, start: int, end: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """(ordinal, item) pairs with start <= ordinal < end, earliest first."""
+        lo = bisect.bisect_left(self.days, start)
+        hi = bisect.bisect_left(self.days, end)
+        return [(day, item) for day in self.days[lo:hi] for item in self.buckets[day]]
+
+    def expired(self, today: int) -> List[Tuple[int, Dict[str, Any]]]:
+        return self._range(0, today)
+
+    def expiring_within(self, today: int, days: int) -> List[Tuple[int, Dict[str, Any]]]:
+        return self._range(today, today + days + 1)
+
+    def ordered(self, today: int) -> List[Tuple[Optional[int], Dict[str, Any]]]:
+        """All items as (days until expiry, item), earliest first, undated items last."""
+        entries = [(day - today, item) for day in self.days for item in self.buckets[day]]
+        entries.extend((None, item) for item in self.undated)
+        return entries
+
+
+class ExpiryIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bins: Dict[str, BinExpiryIndex] = {}
+        self._urgency: Dict[str, Tuple[Optional[int], Dict[str, Any]]] = {}  # bin -> (version, list)
+        self._versions: Dict[str, Optional[int]] = {}
+        self._scanner: Optional[threading.Thread] = None
+
+    def update(self, bin_id: str, inventory: List[Dict[str, Any]], version: Optional[int] = None) -> None:
+        """
+        Rebuilds a bin's buckets from its current inventory (called on every
+        read/write). `version` is the shared-cache bin version the inventory
+        belongs to, if known. Re-reads of an unchanged bin (same version and
+        contents, e.g. after the bin cache expired) keep the existing index
+        and its precomputed urgency list.
+        """
+        fingerprint = hashlib.sha256(
+            json.dumps(inventory, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            current = self._bins.get(bin_id)
+            if (current is not None and current.fingerprint == fingerprint
+                    and self._versions.get(bin_id) == version):
+                return
+
+        index = BinExpiryIndex(inventory)
+        index.fingerprint = fingerprint
+        with self._lock:
+            self._bins[bin_id] = index
+            self._versions[bin_id] = version
+            self._urgency.pop(bin_id, None)
+
+    def invalidate(self, bin_id: str) -> None:
+        with self._lock:
+            self._bins.pop(bin_id, None)
+            self._versions.pop(bin_id, None)
+            self._urgency.pop(bin_id, None)
+
+    def is_current(self, bin_id: str, version: int) -> bool:
+        """True if the bin is indexed from exactly this shared-cache version."""
+        return bin_id in self._bins and self._versions.get(bin_id) == version
+
+    @staticmethod
+    def _today() -> int:
+        return datetime.now().toordinal()
+
+    def expired(self, bin_id: str) -> List[Dict[str, Any]]:
+        """Items whose expiry date is before today."""
+        index = self._bins.get(bin_id)
+        return [item for _, item in index.expired(self._today())] if index else []
+
+    def expiring_within(self, bin_id: str, days: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """(days until expiry, item) for items expiring today through today + days."""
+        index = self._bins.get(bin_id)
+        if not index:
+            return []
+        today = self._today()
+        return [(day - today, item) for day, item in index.expiring_within(today, days)]
+
+    def ordered(self, bin_id: str) -> List[Tuple[Optional[int], Dict[str, Any]]]:
+        """The whole inventory of a bin as (days until expiry, item), earliest first."""
+        index = self._bins.get(bin_id)
+        return index.ordered(self._today()) if index else []
+
+    def urgency(self, bin_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the bin's precomputed urgency list, computing it now if the
+        scan has not done so today for the indexed version of the bin.
+        """
+        with self._lock:
+            cached = self._urgency.get(bin_id)
+            index = self._bins.get(bin_id)
+            version = self._versions.get(bin_id)
+        if index is None:
+            return None
+        if (cached is not None and cached[0] == version
+                and cached[1]["computed_for"] == datetime.now().strftime("%d/%m/%Y")):
+            return cached[1]
+        return self._compute_urgency(bin_id, index)
+
+    def _compute_urgency(self, bin_id: str, index: BinExpiryIndex) -> Dict[str, Any]:
+        today = self._today()
+        with self._lock:
+            version = self._versions.get(bin_id)
+
+        def entry(day, item):
+            return {"name": item.get("name"), "quantity": item.get("quantity"),
+                    "unit": item.get("unit"), "expected_expiry_date": item.get("expected_expiry_date"),
+                    "days_left": day - today}
+
+        urgency = {
+            "computed_for": datetime.fromordinal(today).strftime("%d/%m/%Y"),
+            "expired": [entry(d, i) for d, i in index.expired(today)],
+            "critical": [entry(d, i) for d, i in index._range(today, today + CRITICAL_DAYS + 1)],
+            "high": [entry(d, i) for d, i in index._range(today + CRITICAL_DAYS + 1, today + HIGH_DAYS + 1)],
+        }
+        with self._lock:
+            if self._bins.get(bin_id) is index and self._versions.get(bin_id) == version:
+                self._urgency[bin_id] = (version, urgency)
+        return urgency
+
+    def scan(self) -> None:
+        """Recomputes the urgency list of every indexed bin."""
+        with self._lock:
+            bins = list(self._bins.items())
+        for bin_id, index in bins:
+            self._compute_urgency(bin_id, index)
+        print(f"Expiry scan refreshed {len(bins)} bin(s).")
+
+    def start_background_scan(self, interval: int = SCAN_INTERVAL_SECONDS) -> None:
+        """Starts a daemon thread that rescans all bins every `interval` seconds."""
+        if self._scanner is not None:
+            return
+
+        def run():
+            stop = threading.Event()
+            while not stop.wait(interval):
+                try:
+                    self.scan()
+                except Exception as e:
+                    print(f"Expiry scan failed: {e}")
+
+        self._scanner = threading.Thread(target=run, name="expiry-scan", daemon=True)
+        self._scanner.start()
+
+
+expiry_index = ExpiryIndex()
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Optional, Dict, List, Any, NamedTuple
+
+import admission
+import clients
+
+# =================================================================
+# Gemini call layer.
+# * Static prompt prefixes (the long instruction blocks) are sent once as a
+#   context cache per (model, prefix) and referenced by name afterwards.
+#   Prefixes below the model's minimum cacheable size (GEMINI_CACHE_MIN_TOKENS,
+#   estimated locally) are never offered to the cache API; they, and prefixes
+#   whose cache cannot be created, go as a compacted system instruction.
+# * Small inputs are routed to a cheaper/faster model tier, and so is every
+#   call on a route whose recent latency is over its budget.
+# * Token counts and latency are recorded per route and model (see stats()).
+# * Every call, including cache creation, holds a slot of
+#   admission.gemini_limiter while it runs.
+# =================================================================
+MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+LIGHT_MODEL = os.getenv("GEMINI_LIGHT_MODEL", "gemini-2.0-flash-lite")
+
+CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+# Smallest prefix the context cache API accepts for the configured models
+CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "4096"))
+# Rough characters per token, to estimate prefix size without an API call
+CHARS_PER_TOKEN = 4
+
+# Weight of the newest call in a route's moving average latency
+LATENCY_SMOOTHING = 0.3
+
+
+class RouteConfig(NamedTuple):
+    latency_budget_ms: int  # above this moving average latency, use LIGHT_MODEL
+    light_max_size: int  # inputs up to this size always use LIGHT_MODEL
+
+
+def _route(name: str, budget_ms: int, light_max_size: int) -> RouteConfig:
+    env_name = name.upper().replace("-", "_")
+    return RouteConfig(
+        latency_budget_ms=int(os.getenv(f"GEMINI_BUDGET_MS_{env_name}", budget_ms)),
+        light_max_size=int(os.getenv(f"GEMINI_LIGHT_MAX_{env_name}", light_max_size)),
+    )
+
+
+# Size is image bytes for "analyze" and number of items for the text routes
+ROUTES = {
+    "analyze": _route("analyze", budget_ms=8000, light_max_size=150_000),
+    "estimate": _route("estimate", budget_ms=5000, light_max_size=5),
+    "recipes": _route("recipes", budget_ms=15000, light_max_size=6),
+}
+
+
+def compact(text: str) -> str:
+    """Strips indentation, trailing spaces and blank lines from a prompt block."""
+    lines = (line.strip() for line in text.strip().splitlines())
+    return "\n".join(re.sub(r"\s{2,}", " ", line) for line in lines if line)
+
+
+class _PrefixCache:
+    """Context caches for static prompt prefixes, keyed by (model, prefix hash)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names: Dict[tuple, tuple] = {}  # key -> (cache name, expires at)
+        self._unavailable: Dict[tuple, float] = {}  # key -> retry after
+
+    def get(self, model: str, prefix: str) -> Optional[str]:
+        if len(prefix) / CHARS_PER_TOKEN < CACHE_MIN_TOKENS:
+            return None
+
+        key = (model, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        now = time.time()
+
+        with self._lock:
+            cached = self._names.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+            if self._unavailable.get(key, 0) > now:
+                return None
+
+        try:
+            cache = clients.get_gemini_client().caches.create(
+                model=model,
+                contents=[{"role": "user", "parts": [{"text": prefix}]}],
+                config={"ttl": f"{CACHE_TTL_SECONDS}s", "display_name": f"foodgie-{key[1][:12]}"},
+            )
+        except Exception as e:
+            print(f"Context cache unavailable for {model}, using system instruction: {e}")
+            with self._lock:
+                self._unavailable[key] = now + CACHE_TTL_SECONDS
+            return None
+
+        with self._lock:
+            # Refresh a minute before the server-side TTL runs out
+            self._names[key] = (cache.name, now + CACHE_TTL_SECONDS - 60)
+        print(f"Created context cache {cache.name} for {model}")
+        return cache.name
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def latency_ms(self, route: str) -> float:
+        return self._routes.get(route, {}).get("avg_latency_ms", 0)
+
+    def record(self, route: str, model: str, usage, latency_ms: float, over_budget: bool) -> None:
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage, "candidates_token_count", None) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+
+        with self._lock:
+            route_stats = self._routes.setdefault(
+                route, {"calls": 0, "over_budget": 0, "avg_latency_ms": 0, "models": {}}
+            )
+            route_stats["calls"] += 1
+            route_stats["over_budget"] += int(over_budget)
+            route_stats["avg_latency_ms"] = (
+                latency_ms if route_stats["calls"] == 1
+                else (1 - LATENCY_SMOOTHING) * route_stats["avg_latency_ms"] + LATENCY_SMOOTHING * latency_ms
+            )
+
+            model_stats = route_stats["models"].setdefault(
+                model, {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+            )
+            model_stats["calls"] += 1
+            model_stats["input_tokens"] += prompt_tokens
+            model_stats["cached_tokens"] += cached_tokens
+            model_stats["output_tokens"] += output_tokens
+
+        print(f"Gemini [{route}] {model}: {prompt_tokens} in ({cached_tokens} cached), "
+              f"{output_tokens} out, {latency_ms:.0f} ms")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                route: dict(s, models={m: dict(v) for m, v in s["models"].items()})
+                for route, s in self._routes.items()
+            }
+
+
+_prefix_cache = _PrefixCache()
+_stats = _Stats()
+
+
+def choose_model(route: str, size: int) -> str:
+    """Picks the model tier for a call on `route` with an input of `size`."""
+    config = ROUTES[route]
+    if size <= config.light_max_size:
+        return LIGHT_MODEL
+    if _stats.latency_ms(route) > config.latency_budget_ms:
+        return LIGHT_MODEL
+    return MODEL
+
+
+def generate(route: str, static_prefix: str, parts: List[Dict[str, Any]], size: int = 0):
+    """
+    Calls Gemini for one route.
+
+    Args:
+        route: Key into ROUTES, used for model routing and stats.
+        static_prefix: Instruction block identical across requests of this route.
+        parts: The request-specific content parts (text and/or inline images).
+        size: Input size used for tier routing (see ROUTES).
+
+    Returns:
+        The GenerateContentResponse.
+    """
+    model = choose_model(route, size)
+    prefix = compact(static_prefix)
+
+    # Raises admission.Overloaded when the Gemini queue is full
+    acquired_at = admission.gemini_limiter.acquire(admission.PRIORITY.get(route, 1))
+    try:
+        # May create the context cache, which is a Gemini request too
+        cache_name = _prefix_cache.get(model, prefix)
+        if cache_name:
+            config = {"cached_content": cache_name}
+        else:
+            config = {"system_instruction": prefix}
+
+        start = time.perf_counter()
+        response = clients.get_gemini_client().models.generate_content(
+            model=model,
+            contents=[{"role": "user", "parts": parts}],
+            config=config,
+        )
+        latency_ms = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        # Upstream quota exhausted: shed load like a full queue instead of a 500
+        if getattr(e, "code", None) == 429:
+            raise admission.Overloaded("Gemini quota exceeded", admission.gemini_limiter.retry_after()) from e
+        raise
+    finally:
+        admission.gemini_limiter.release(acquired_at)
+
+    _stats.record(route, model, getattr(response, "usage_metadata", None), latency_ms,
+                  latency_ms > ROUTES[route].latency_budget_ms)
+    return response
+
+
+def stats() -> Dict[str, Any]:
+    """Per-route call counts, latency and per-model token totals."""
+    return _stats.snapshot()
@@ -0,0 +1,180 @@
+import csv
+import math
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Any, NamedTuple, Tuple
+
+# =================================================================
+# Local nutrition and shelf-life reference table.
+# nutrition_reference.csv holds one row per (food name, unit):
+#   * "items", "containers", "eggs" -> values are per 1 unit
+#   * "grams"                       -> values are per 100 grams
+# shelf_days is the expected fridge life counted from the purchase date.
+# The table is loaded once per process into a dict keyed by
+# (normalized name, unit) so every lookup is a single hash probe.
+# =================================================================
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition_reference.csv")
+GRAMS_PER_ENTRY = 100
+
+NUTRITION_FIELDS = ("calories", "carbs", "fats", "protein")
+
+# Shelf life assumed when an estimate gives none (or an unusable one)
+DEFAULT_SHELF_DAYS = 7
+MAX_SHELF_DAYS = 3650
+
+
+class FoodReference(NamedTuple):
+    type: str
+    calories: int
+    carbs: int
+    fats: int
+    protein: int
+    shelf_days: int
+
+
+_reference: Optional[Dict[Tuple[str, str], FoodReference]] = None
+_lock = threading.Lock()
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a food name for lookup: lowercase, punctuation stripped,
+    whitespace collapsed and the last word singularized ("Cherry Tomatoes" ->
+    "cherry tomato").
+    """
+    words = re.sub(r"[^a-z0-9 ]+", " ", str(name).lower()).split()
+    if not words:
+        return ""
+
+    last = words[-1]
+    if last.endswith("ies") and len(last) > 4:
+        last = last[:-3] + "y"
+    elif last.endswith("oes") and len(last) > 4:
+        last = last[:-2]
+    elif last.endswith("s") and not last.endswith("ss") and len(last) > 3:
+        last = last[:-1]
+    words[-1] = last
+
+    return " ".join(words)
+
+
+def load_reference() -> Dict[Tuple[str, str], FoodReference]:
+    """Loads the reference CSV once per process and returns the index."""
+    global _reference
+    if _reference is None:
+        with _lock:
+            if _reference is None:
+                index = {}
+                with open(REFERENCE_PATH, newline="", encoding="utf-8") as f:
+                    for row in csv.DictReader(f):
+                        key = (normalize_name(row["name"]), row["unit"])
+                        index[key] = FoodReference(
+                            type=row["type"],
+                            calories=int(row["calories"]),
+                            carbs=int(row["carbs"]),
+                            fats=int(row["fats"]),
+                            protein=int(row["protein"]),
+                            shelf_days=int(row["shelf_days"]),
+                        )
+                print(f"Loaded {len(index)} nutrition reference entries.")
+                _reference = index
+    return _reference
+
+
+def lookup(name: str, unit: str) -> Optional[FoodReference]:
+    """Returns the reference entry for a food name and unit, or None if unknown."""
+    return load_reference().get((normalize_name(name), unit))
+
+
+def _parse_amount(field: str, value: Any) -> int:
+    """A finite, non-negative number (or numeric string) as a whole number; None and "" are 0."""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool):
+        raise ValueError(f"'{field}' must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' must be a number") from None
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"'{field}' must be a non-negative number")
+    return round(number)
+
+
+def parse_nutrition(values: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Reads NUTRITION_FIELDS from a meal payload as whole numbers; missing or
+    null fields count as 0.
+
+    Raises:
+        ValueError: A field is not a finite, non-negative number.
+    """
+    return {field: _parse_amount(field, values.get(field)) for field in NUTRITION_FIELDS}
+
+
+def parse_estimate(estimate: Dict[str, Any]) -> Tuple[Dict[str, int], int]:
+    """
+    Reads a model's estimate for one item. Unlike parse_nutrition this never
+    raises: unusable nutrition values become 0 and an unusable shelf life
+    becomes DEFAULT_SHELF_DAYS.
+
+    Returns:
+        (nutrition totals keyed by NUTRITION_FIELDS, shelf life in days)
+    """
+    totals = {}
+    for field in NUTRITION_FIELDS:
+        try:
+            totals[field] = _parse_amount(field, estimate.get(field))
+        except ValueError:
+            print(f"Warning: Ignoring estimated {field} {estimate.get(field)!r}")
+            totals[field] = 0
+
+    try:
+        shelf_days = _parse_amount("shelf_life_days", estimate.get("shelf_life_days", DEFAULT_SHELF_DAYS))
+    except ValueError:
+        print(f"Warning: Ignoring estimated shelf life {estimate.get('shelf_life_days')!r}")
+        shelf_days = DEFAULT_SHELF_DAYS
+    return totals, min(shelf_days, MAX_SHELF_DAYS)
+
+
+def expiry_from_shelf_life(shelf_days: int, today: Optional[datetime] = None) -> str:
+    """Returns the DD/MM/YYYY expiry date for an item bought today."""
+    today = today or datetime.now()
+    return (today + timedelta(days=int(shelf_days))).strftime("%d/%m/%Y")
+
+
+def enrich_item(item: Dict[str, Any], today: Optional[datetime] = None) -> bool:
+    """
+    Fills in total nutrition and expected expiry date for a detected item
+    from the reference table. Nutrition is scaled to the item's quantity.
+
+    Returns:
+        True if the item was found in the table, False if it is unknown.
+    """
+    ref = lookup(item.get("name", ""), item.get("unit", ""))
+    if ref is None:
+        return False
+
+    quantity = item.get("quantity", 1)
+    if not isinstance(quantity, (int, float)) or quantity <= 0:
+        quantity = 1
+
+    scale = quantity / GRAMS_PER_ENTRY if item.get("unit") == "grams" else quantity
+    for field in NUTRITION_FIELDS:
+        item[field] = round(getattr(ref, field) * scale)
+
+    item.setdefault("type", ref.type)
+    item["expected_expiry_date"] = expiry_from_shelf_life(ref.shelf_days, today)
+    return True
+
+
+def enrich_inventory(items: List[Dict[str, Any]], today: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Enriches every item in place from the reference table.
+
+    Returns:
+        The items that were not found and still need nutrition and expiry.
+    """
+    return [item for item in items if not enrich_item(item, today)]
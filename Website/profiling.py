@@ -0,0 +1,210 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional, Dict, List, Any
+
+from flask import Blueprint, g, request, jsonify, send_from_directory, abort
+
+# =================================================================
+# On-demand request profiling.
+# A request is profiled when it carries "X-Profile: 1" (or ?profile=1) plus
+# an "X-Profile-Token" header matching PROFILE_TOKEN, or when it is picked
+# by random sampling at PROFILE_SAMPLE_RATE. Each profiled request produces:
+#   * <id>.pstats    - cProfile output (python -m pstats, snakeviz, ...)
+#   * <id>.collapsed - sampled stacks in collapsed format, ready for
+#                      flamegraph.pl / speedscope; includes upstream waits
+#   * <id>.json      - request metadata
+# Files are listed and served by the /debug/profiles endpoints, which also
+# require the token. The client address is deliberately not trusted: behind
+# a reverse proxy every request comes from the proxy's address. With no
+# PROFILE_TOKEN set, on-demand profiling and the endpoints are disabled.
+# =================================================================
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"),
+)
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+STACK_SAMPLE_INTERVAL = float(os.getenv("PROFILE_STACK_INTERVAL_MS", "5")) / 1000
+KEEP_PROFILES = int(os.getenv("PROFILE_KEEP", "50"))
+
+bp = Blueprint("profiling", __name__, url_prefix="/debug/profiles")
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _has_profile_token() -> bool:
+    token = request.headers.get("X-Profile-Token", "")
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def _requested_trigger() -> Optional[str]:
+    """Returns why this request should be profiled, or None."""
+    flag = request.headers.get("X-Profile") or request.args.get("profile")
+    if flag in ("1", "true") and _has_profile_token():
+        return "requested"
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def _start_profile():
+    if request.blueprint == bp.name:
+        return
+
+    trigger = _requested_trigger()
+    if trigger is None:
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler is already active in this thread
+        print(f"Profiling skipped: {e}")
+        return
+
+    sampler = _StackSampler(threading.get_ident(), STACK_SAMPLE_INTERVAL)
+    sampler.start()
+    g._profile = {
+        "id": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        "trigger": trigger,
+        "profiler": profiler,
+        "sampler": sampler,
+        "start": time.perf_counter(),
+    }
+
+
+def _stop_profile() -> Optional[Dict[str, Any]]:
+    profile = g.pop("_profile", None)
+    if profile is None:
+        return None
+    profile["profiler"].disable()
+    profile["sampler"].stop()
+    profile["duration_ms"] = (time.perf_counter() - profile["start"]) * 1000
+    return profile
+
+
+def _save_profile(profile: Dict[str, Any], status_code: int) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile["id"])
+
+    profile["profiler"].dump_stats(f"{base}.pstats")
+
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        for stack, count in profile["sampler"].counts.most_common():
+            f.write(f"{stack} {count}\n")
+
+    metadata = {
+        "id": profile["id"],
+        "method": request.method,
+        "path": request.path,
+        "status": status_code,
+        "trigger": profile["trigger"],
+        "duration_ms": round(profile["duration_ms"], 1),
+        "stack_samples": sum(profile["sampler"].counts.values()),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(f"{base}.json", "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+    print(f"Profiled {request.method} {request.path} in {metadata['duration_ms']} ms -> {profile['id']}")
+    _prune_profiles()
+
+
+def _prune_profiles() -> None:
+    """Keeps only the newest KEEP_PROFILES profiles on disk."""
+    ids = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for old_id in ids[:-KEEP_PROFILES] if KEEP_PROFILES > 0 else ids:
+        for ext in (".json", ".pstats", ".collapsed"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def _finish_profile(response):
+    profile = _stop_profile()
+    if profile is not None:
+        try:
+            _save_profile(profile, response.status_code)
+            response.headers["X-Profile-Id"] = profile["id"]
+        except OSError as e:
+            print(f"Failed to save profile: {e}")
+    return response
+
+
+def _discard_profile(exc):
+    # Requests that never reached after_request still stop their profiler
+    _stop_profile()
+
+
+def _list_profiles() -> List[Dict[str, Any]]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(".json"):
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+    return profiles
+
+
+@bp.before_request
+def _require_profile_token():
+    if not PROFILE_TOKEN:
+        abort(404)
+    if not _has_profile_token():
+        abort(403)
+
+
+@bp.route("")
+def list_profiles():
+    """Metadata of stored profiles, newest first."""
+    return jsonify({"profiles": _list_profiles()})
+
+
+@bp.route("/<profile_id>.<any(pstats, collapsed):kind>")
+def get_profile(profile_id, kind):
+    """Downloads a profile as pstats or collapsed stacks."""
+    return send_from_directory(PROFILE_DIR, f"{profile_id}.{kind}", as_attachment=True)
+
+
+def init_app(app) -> None:
+    """Registers the profiling hooks and debug endpoints on the app."""
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_discard_profile)
+    app.register_blueprint(bp)
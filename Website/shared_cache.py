@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional, Dict, Any
+
+# =================================================================
+# Process-shared cache (and host-wide rate limit buckets, see take_token).
+# One SQLite file (WAL mode) per host, shared by every worker process, so a
+# bin read, recipe result or image analysis done by one worker is a hit for
+# all the others.
+# Entries tied to a bin record the bin's version when they were computed.
+# Every successful write to a bin bumps its version in the same database, so
+# the next read in ANY worker sees the newer version and treats older
+# entries as misses (cross-process invalidation without messaging).
+# =================================================================
+CACHE_PATH = os.getenv(
+    "SHARED_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "foodgie-cache.sqlite3"),
+)
+
+# Chance that a write also purges expired rows
+PURGE_PROBABILITY = 0.01
+
+
+class SharedCache:
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; creates the schema on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT, key TEXT, value TEXT, bin_id TEXT, version INTEGER,"
+                " expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bin_versions (bin_id TEXT PRIMARY KEY, version INTEGER)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _count(self, namespace: str, outcome: str) -> None:
+        with self._stats_lock:
+            counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    def bin_version(self, bin_id: str) -> int:
+        """
+        Current version of a bin (0 if it was never written through this host,
+        -1 if the cache is unavailable, which never matches a stored entry).
+        """
+        try:
+            row = self._conn().execute(
+                "SELECT version FROM bin_versions WHERE bin_id = ?", (bin_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache read failed: {e}")
+            return -1
+        return row[0] if row else 0
+
+    def bump_bin_version(self, bin_id: str) -> int:
+        """Marks a bin as written; every worker's older entries for it become stale."""
+        try:
+            row = self._conn().execute(
+                "INSERT INTO bin_versions (bin_id, version) VALUES (?, 1) "
+                "ON CONFLICT (bin_id) DO UPDATE SET version = version + 1 "
+                "RETURNING version",
+                (bin_id,),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache write failed: {e}")
+            return -1
+        return row[0]
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        Returns the cached value, or None if missing, expired, or computed
+        from an older version of its bin.
+        """
+        try:
+            row = self._conn().execute(
+                "SELECT e.value FROM entries e LEFT JOIN bin_versions b ON e.bin_id = b.bin_id "
+                "WHERE e.namespace = ? AND e.key = ? AND e.expires_at > ? "
+                "AND (e.bin_id IS NULL OR e.version = COALESCE(b.version, 0))",
+                (namespace, key, time.time()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            # The cache is an optimization; fail open
+            print(f"Shared cache read failed: {e}")
+            row = None
+
+        if row is None:
+            self._count(namespace, "misses")
+            return None
+        self._count(namespace, "hits")
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float,
+            bin_id: Optional[str] = None, version: Optional[int] = None) -> bool:
+        """
+        Stores a value for `ttl` seconds. For bin-derived values pass the
+        bin_id and the bin version read BEFORE computing the value; the
+        entry is only stored if the bin has not been written since.
+
+        Returns:
+            True if stored.
+        """
+        conn = self._conn()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if bin_id is not None:
+                current = self.bin_version(bin_id)
+                if version is None:
+                    version = current
+                elif version != current:
+                    conn.execute("ROLLBACK")
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, bin_id, version, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), bin_id, version, now + ttl),
+            )
+            if random.random() < PURGE_PROBABILITY:
+                conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+            return True
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Shared cache write failed: {e}")
+            return False
+
+    def take_token(self, key: str, rate_per_second: float, burst: float) -> float:
+        """
+        Takes one token from a host-wide token bucket (refilled at
+        rate_per_second, holding at most `burst` tokens).
+
+        Returns:
+            0 if a token was taken, otherwise seconds until one is available.
+        """
+        conn = self._conn()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate_per_second)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate_per_second
+
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            if random.random() < PURGE_PROBABILITY:
+                # Buckets idle long enough to be full again carry no state
+                conn.execute(
+                    "DELETE FROM token_buckets WHERE updated_at <= ?", (now - burst / rate_per_second,)
+                )
+            conn.execute("COMMIT")
+            return wait
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Fail open: rate limiting must not take the app down with the cache
+            print(f"Shared cache rate limit failed: {e}")
+            return 0.0
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss counts of this worker process, per namespace."""
+        with self._stats_lock:
+            return {namespace: dict(counts) for namespace, counts in self._stats.items()}
+
+
+shared_cache = SharedCache()
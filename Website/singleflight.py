@@ -0,0 +1,58 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+# =================================================================
+# Single-flight de-duplication of upstream calls.
+# While a call for a key is running, identical calls (same key) wait for it
+# and receive its result (or its exception) instead of starting their own
+# request. Nothing is cached: once the call finishes, the next one for the
+# same key goes upstream again.
+# =================================================================
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs fn(*args, **kwargs) unless a call with the same key is already
+        in flight, in which case waits for that call and returns its result.
+
+        Results are shared between callers; callers that mutate them must copy.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            print(f"   Joining in-flight request: {key[0] if isinstance(key, tuple) else key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+inflight = SingleFlight()
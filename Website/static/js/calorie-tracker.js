@@ -91,6 +91,10 @@ class CalorieTracker {
       fats: log.totalFats
     });
 
+    if (nutritionData.skipServerSync) {
+      return meal;
+    }
+
     // Send to server for tracking
     try {
       const response = await fetch('/api/calorie-tracker', {
@@ -100,6 +104,9 @@ class CalorieTracker {
         },
         body: JSON.stringify({
           calories: calories,
+          protein: meal.protein,
+          carbs: meal.carbs,
+          fats: meal.fats,
           recipe_name: name
         })
       });
@@ -98,6 +98,12 @@ class RecipeManager {
       target_calories_per_meal: targetCaloriesPerMeal
     };
 
+    // Let the server compute the per-meal budget from its own calorie log
+    if (this.calorieTracker) {
+      requestData.daily_calories = this.calorieTracker.settings.dailyCalories;
+      requestData.daily_meals = this.calorieTracker.settings.dailyMeals;
+    }
+
     this.showLoading();
 
     try {
@@ -422,7 +428,17 @@ class RecipeManager {
           headers: {
             'Content-Type': 'application/json'
           },
-          body: JSON.stringify({ consumed: consumedMap })
+          body: JSON.stringify({
+            consumed: consumedMap,
+            // The server logs this meal to its calorie log on success
+            meal: {
+              name: recipe.name,
+              calories: totalCalories,
+              protein: (nutrition.protein || 0) * servings,
+              carbs: (nutrition.carbs || 0) * servings,
+              fats: (nutrition.fats || 0) * servings
+            }
+          })
         });
 
         if (!consumeResponse.ok) {
@@ -444,7 +460,9 @@ class RecipeManager {
         protein: (nutrition.protein || 0) * servings,
         carbs: (nutrition.carbs || 0) * servings,
         fats: (nutrition.fats || 0) * servings,
-        servings: servings
+        servings: servings,
+        // Already logged server-side by /api/consume
+        skipServerSync: Object.keys(consumedMap).length > 0
       });
       console.log('✅ Meal logged successfully');
 